@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Run the animation runtime against a fake HID keyboard with simulated write latency.
+
+Run from the repository root : python benchmarks/bench_animation.py [LATENCY_MS]
+"""
+import os
+import sys
+from time import sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from msi_perkeyrgb_gui.animation import Animator, rainbow_wave  # noqa: E402
+from msi_perkeyrgb_gui.hidapi_wrapping import DELAY, ReportPacer  # noqa: E402
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard  # noqa: E402
+
+MODEL = "GP75"
+DURATION = 3.0
+
+
+class FakeHID:
+    """Accepts every report after sleeping for a fixed write latency"""
+
+    def __init__(self, latency, min_gap=DELAY):
+        self.pacer = ReportPacer(min_gap)
+        self.latency = latency
+        self.reports = 0
+
+    def send_feature_report(self, data):
+        self.pacer.wait()
+        sleep(self.latency)
+        self.pacer.mark()
+        self.reports += 1
+
+    send_output_report = send_feature_report
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.001
+    msi_keymap = MSIKeyboard.get_model_keymap(MODEL)
+
+    for min_gap, fps in ((DELAY, 20), (DELAY, 60), (0.002, 60)):
+        hid = FakeHID(latency, min_gap)
+        kb = MSIKeyboard(None, msi_keymap, {}, hid_keyboard=hid)
+        animator = Animator(kb, rainbow_wave(msi_keymap), fps)
+        stats = animator.run(duration=DURATION)
+        print(
+            "gap %4.1f ms, target %5.1f fps : %s, %d reports"
+            % (min_gap * 1000, animator.fps, stats, hid.reports)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Compare config.parse_config against the previous parser on a large generated config.
+
+Run from the repository root : python benchmarks/bench_config.py
+"""
+import io
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from msi_perkeyrgb_gui.config import ALIASES, parse_config  # noqa: E402
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard  # noqa: E402
+from msi_perkeyrgb_gui.parsing import parse_color  # noqa: E402
+
+MODEL = "GP75"
+NB_LINES = 5000
+NUMBER = 5
+COLORS = ["ff0000", "00ff00", "0000ff", "red", "teal", "orange", "ffffff", "123456"]
+
+
+class LineParseError(Exception):
+    pass
+
+
+def previous_parse_keycodes(msi_keymap, keys_parameter):
+    # parse_keycodes as it was before the precompiled patterns
+    keycodes = []
+    for alias in ALIASES.keys():
+        keys_parameter = keys_parameter.replace(alias, ALIASES[alias])
+
+    for key_str in keys_parameter.split(","):
+        if re.fullmatch("^[0-9]+$", key_str):
+            keycode = int(key_str)
+            if keycode not in msi_keymap.keys():
+                raise LineParseError("%s is not a valid keycode." % key_str)
+            keycodes.append(keycode)
+        elif re.fullmatch("^[0-9]+-[0-9]+$", key_str):
+            keycode_1, keycode_2 = [int(s) for s in key_str.split("-")]
+            if (
+                keycode_2 <= keycode_1
+                or keycode_1 not in msi_keymap.keys()
+                or keycode_2 not in msi_keymap.keys()
+            ):
+                raise LineParseError("%s is not a valid keycode range." % key_str)
+            keycodes += [
+                k for k in range(keycode_1, keycode_2 + 1) if k in msi_keymap.keys()
+            ]
+        else:
+            raise LineParseError("%s is not a keycode nor an alias." % key_str)
+    return keycodes
+
+
+def previous_parse_config(f, msi_keymap):
+    colors_map = {}
+    for i, line in enumerate(f):
+        line = line.replace("\n", "")
+        if line.replace(" ", "")[0] == "#":
+            continue
+        parameters = list(filter(None, line.split(" ")))
+        keycodes = previous_parse_keycodes(msi_keymap, parameters[0])
+        _color = parse_color(parameters[2])
+        color = [int(_color[i : i + 2], 16) for i in [0, 2, 4]]
+        for k in keycodes:
+            colors_map[k] = color
+    return colors_map, []
+
+
+def generate_config(msi_keymap, nb_lines):
+    rng = random.Random(0)
+    keycodes = sorted(msi_keymap)
+    lines = ["# Generated config"]
+    for _ in range(nb_lines):
+        kind = rng.random()
+        if kind < 0.6:
+            keys = str(rng.choice(keycodes))
+        elif kind < 0.9:
+            keys = ",".join(str(k) for k in rng.sample(keycodes, 4))
+        else:
+            keys = rng.choice(list(ALIASES))
+        lines.append("%s steady %s" % (keys, rng.choice(COLORS)))
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    msi_keymap = MSIKeyboard.get_model_keymap(MODEL)
+    config = generate_config(msi_keymap, NB_LINES)
+
+    expected = previous_parse_config(io.StringIO(config), msi_keymap)[0]
+    assert parse_config(io.StringIO(config), msi_keymap)[0] == expected
+
+    results = {}
+    for name, func in (
+        ("previous parser", previous_parse_config),
+        ("parse_config", parse_config),
+    ):
+        best = min(
+            timeit.repeat(
+                lambda: func(io.StringIO(config), msi_keymap), number=NUMBER, repeat=5
+            )
+        )
+        results[name] = best / NUMBER * 1e3
+        print("%-16s %8.2f ms per %d lines" % (name, results[name], NB_LINES))
+
+    print("speedup : x%.2f" % (results["previous parser"] / results["parse_config"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Compare the __slots__ Key against the previous pydantic model on a full layout.
+
+Covers loading the bindings, assigning a color to every key and save_keys.
+The pydantic side is skipped when pydantic is not installed.
+
+Run from the repository root : python benchmarks/bench_keys.py
+"""
+import json
+import os
+import sys
+import tempfile
+import timeit
+from typing import Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from msi_perkeyrgb_gui.key import Key  # noqa: E402
+from msi_perkeyrgb_gui.keyboard import Keyboard  # noqa: E402
+from msi_perkeyrgb_gui.parsing import parse_color  # noqa: E402
+
+MODEL = "GP75"
+NUMBER = 200
+BINDINGS_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "msi_perkeyrgb_gui", "bindings", MODEL + ".json"
+)
+
+
+def pydantic_key_class():
+    # Key as it was before, None without pydantic
+    try:
+        from pydantic import BaseModel, validator
+    except ImportError:
+        return None
+
+    class PydanticKey(BaseModel):
+        box: Tuple[
+            Tuple[int, int],
+            Tuple[int, int],
+        ]
+        keycode: int
+        name: str
+        color: str = "000000"
+
+        def __eq__(self, other):
+            if isinstance(other, type(self)):
+                return other.keycode == self.keycode
+            return False
+
+        def __hash__(self):
+            return self.keycode
+
+        @validator("color", pre=True)
+        def v_color(cls, v) -> str:
+            return parse_color(v)
+
+    return PydanticKey
+
+
+def run(key_class, bindings, save_path):
+    keys = sorted({key_class(**i) for i in bindings}, key=lambda x: x.keycode)
+    keyboard = Keyboard(keys)
+    for i, key in enumerate(keyboard):
+        key.color = "%06x" % i
+    keyboard.save_keys(save_path)
+
+
+def main():
+    with open(BINDINGS_PATH) as f:
+        bindings = json.load(f)
+
+    key_classes = [("__slots__ Key", Key)]
+    pydantic_key = pydantic_key_class()
+    if pydantic_key is None:
+        print("pydantic is not installed, only timing the __slots__ Key")
+    else:
+        key_classes.insert(0, ("pydantic Key", pydantic_key))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        save_path = os.path.join(tmp, "keys.json")
+        for name, key_class in key_classes:
+            best = min(
+                timeit.repeat(
+                    lambda: run(key_class, bindings, save_path),
+                    number=NUMBER,
+                    repeat=5,
+                )
+            )
+            results[name] = best / NUMBER * 1e3
+            print(
+                "%-14s %8.3f ms per load, recolor and save of %d keys"
+                % (name, results[name], len(bindings))
+            )
+
+    if len(results) == 2:
+        print("speedup : x%.2f" % (results["pydantic Key"] / results["__slots__ Key"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare MSIKeyboard.set_colors against the previous per-key region scan.
+
+Run from the repository root : python benchmarks/bench_layout.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard  # noqa: E402
+from msi_perkeyrgb_gui.msiprotocol import make_key_colors_packet  # noqa: E402
+from msi_perkeyrgb_gui.protocol_data.keycodes import REGION_KEYCODES  # noqa: E402
+
+MODEL = "GP75"
+NUMBER = 2000
+
+
+class NullHID:
+    def send_feature_report(self, data):
+        pass
+
+    def send_output_report(self, data):
+        pass
+
+
+def scan_set_colors(hid_keyboard, msi_keymap, linux_colors_map):
+    # set_colors as it was before the layout tables
+    msi_colors_map = {msi_keymap[k]: c for k, c in linux_colors_map.items()}
+
+    maps_sorted_by_region = {}
+    for keycode in msi_colors_map.keys():
+        for region in REGION_KEYCODES.keys():
+            if keycode in REGION_KEYCODES[region]:
+                if region not in maps_sorted_by_region.keys():
+                    maps_sorted_by_region[region] = {}
+                maps_sorted_by_region[region][keycode] = msi_colors_map[keycode]
+
+    for region, region_colors_map in maps_sorted_by_region.items():
+        hid_keyboard.send_feature_report(
+            make_key_colors_packet(region, region_colors_map)
+        )
+
+
+def main():
+    msi_keymap = MSIKeyboard.get_model_keymap(MODEL)
+    kb = MSIKeyboard(None, msi_keymap, {}, hid_keyboard=NullHID())
+    linux_colors_map = {k: [0x12, 0x34, 0x56] for k in msi_keymap}
+
+    def layout():
+        kb.invalidate()
+        kb.set_colors(linux_colors_map)
+
+    def scan():
+        scan_set_colors(NullHID(), msi_keymap, linux_colors_map)
+
+    results = {}
+    for name, func in (("region scan", scan), ("layout tables", layout)):
+        best = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        results[name] = best / NUMBER * 1e6
+        print("%-15s %8.1f us per full keyboard" % (name, results[name]))
+
+    print("speedup : x%.2f" % (results["region scan"] / results["layout tables"]))
+
+
+if __name__ == "__main__":
+    main()
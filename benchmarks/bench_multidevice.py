@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Time full frames sent to several simulated keyboards, one after the other
+and through a KeyboardGroup, with and without synchronization.
+
+Each keyboard has its own report pacing, so the group should take about the
+time of a single keyboard whatever their number.
+
+Run from the repository root : python benchmarks/bench_multidevice.py
+"""
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from msi_perkeyrgb_gui.hidapi_wrapping import DELAY, HID_Keyboard  # noqa: E402
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard  # noqa: E402
+from msi_perkeyrgb_gui.writer import KeyboardGroup  # noqa: E402
+
+MODEL = "GP75"
+FRAMES = 10
+NB_KEYBOARDS = [1, 2, 4, 8]
+
+
+def open_keyboards(n, msi_keymap, msi_presets):
+    return [
+        MSIKeyboard(
+            None,
+            msi_keymap,
+            msi_presets,
+            hid_keyboard=HID_Keyboard(None, DELAY, backend="sim"),
+        )
+        for _ in range(n)
+    ]
+
+
+def frames(msi_keymap):
+    # Every key changes at every frame, so every region is sent
+    return [{k: [i, 255 - i, i] for k in msi_keymap} for i in range(FRAMES)]
+
+
+def run_serial(keyboards, colors_maps):
+    start = perf_counter()
+    for colors_map in colors_maps:
+        for kb in keyboards:
+            kb.set_colors(colors_map)
+            kb.refresh()
+    return perf_counter() - start
+
+
+def run_group(keyboards, colors_maps, synchronized):
+    start = perf_counter()
+    with KeyboardGroup(keyboards, synchronized) as group:
+        for colors_map in colors_maps:
+            # One frame at a time, as frames submitted meanwhile would be merged
+            group.submit(colors_map)
+            group.flush()
+    return perf_counter() - start
+
+
+def main():
+    msi_keymap = MSIKeyboard.get_model_keymap(MODEL)
+    msi_presets = MSIKeyboard.get_model_presets(MODEL)
+    colors_maps = frames(msi_keymap)
+
+    print("Milliseconds per frame")
+    print("%-10s %12s %12s %12s" % ("keyboards", "serial", "group", "synchronized"))
+    for n in NB_KEYBOARDS:
+        times = [
+            run_serial(open_keyboards(n, msi_keymap, msi_presets), colors_maps),
+            run_group(open_keyboards(n, msi_keymap, msi_presets), colors_maps, False),
+            run_group(open_keyboards(n, msi_keymap, msi_presets), colors_maps, True),
+        ]
+        print(
+            "%-10d %12.1f %12.1f %12.1f"
+            % (n, *(t * 1000 / len(colors_maps) for t in times))
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""Benchmark suite of the parse -> compile -> send pipeline and of the CLI start.
+
+Keyboard writes go to a fake HID sink, and the CLI runs with the simulated
+backend, so no hardware is needed.
+
+Run from the repository root :
+    python benchmarks/run_benchmarks.py [-o results.json] [--baseline baseline.json]
+With --baseline, exits with an error if a benchmark is slower than the
+baseline by more than --tolerance. Command line modes exiting with an error
+are reported as failed instead of timed, and also make it exit with an error.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import timeit
+from time import perf_counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from msi_perkeyrgb_gui import __version__  # noqa: E402
+from msi_perkeyrgb_gui.config import ALIASES, parse_config  # noqa: E402
+from msi_perkeyrgb_gui.keyboard import Keyboard  # noqa: E402
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard  # noqa: E402
+from msi_perkeyrgb_gui.msiprotocol import make_key_colors_packet  # noqa: E402
+from msi_perkeyrgb_gui.parsing import parse_color  # noqa: E402
+
+MODEL = "GP75"
+PACKAGE_DIR = os.path.join(ROOT, "msi_perkeyrgb_gui")
+BINDINGS_PATH = os.path.join(PACKAGE_DIR, "bindings", MODEL + ".json")
+DEFAULT_CONFIG_PATH = os.path.join(PACKAGE_DIR, "configs", "default.msic")
+REPEAT = 5
+CLI_RUNS = 5
+DEFAULT_TOLERANCE = 0.25
+
+# Modes of the command line, run with the simulated keyboard
+CLI_MODES = {
+    "version": ["--version"],
+    "list-models": ["--list-models"],
+    "list-presets": ["--list-presets"],
+    "steady": ["-s", "red"],
+    "preset": ["-p", "aqua"],
+    "disable": ["-d"],
+    "effect": ["-e", "breathing"],
+    "stream": ["-c", "-"],
+}
+
+
+class NullHID:
+    def send_feature_report(self, data):
+        pass
+
+    def send_output_report(self, data):
+        pass
+
+
+def generate_config(msi_keymap, nb_lines):
+    rng = random.Random(0)
+    keycodes = sorted(msi_keymap)
+    colors = ["ff0000", "00ff00", "0000ff", "red", "teal", "ffffff", "123456"]
+    lines = ["# Generated config"]
+    for _ in range(nb_lines):
+        kind = rng.random()
+        if kind < 0.6:
+            keys = str(rng.choice(keycodes))
+        elif kind < 0.9:
+            keys = ",".join(str(k) for k in rng.sample(keycodes, 4))
+        else:
+            keys = rng.choice(list(ALIASES))
+        lines.append("%s steady %s" % (keys, rng.choice(colors)))
+    return "\n".join(lines) + "\n"
+
+
+def time_call(func):
+    """Best time of one call, in seconds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()  # About 0.2 s per timing run
+    return min(timer.repeat(repeat=REPEAT, number=number)) / number
+
+
+def library_benchmarks(tmp):
+    msi_keymap = MSIKeyboard.get_model_keymap(MODEL)
+    msi_presets = MSIKeyboard.get_model_presets(MODEL)
+    preset = "aqua"
+    kb = MSIKeyboard(None, msi_keymap, msi_presets, hid_keyboard=NullHID())
+
+    with open(DEFAULT_CONFIG_PATH) as f:
+        small_config = f.read()
+    huge_config = generate_config(msi_keymap, 10000)
+    colors_map = {k: [0x12, 0x34, 0x56] for k in msi_keymap}
+    alphanum = {k: [0x12, 0x34, 0x56] for k in list(msi_keymap.values())[:42]}
+
+    keyboard = Keyboard.load_keys(BINDINGS_PATH)
+    colors_path = os.path.join(tmp, "colors.msic")
+    keys_path = os.path.join(tmp, "keys.json")
+
+    def set_colors_full():
+        kb.invalidate()
+        kb.set_colors(colors_map)
+        kb.refresh()
+
+    def set_colors_unchanged():
+        kb.set_colors(colors_map)
+        kb.refresh()
+
+    def set_preset():
+        kb.set_preset(preset)
+        kb.refresh()
+
+    return {
+        "parse_config.small": lambda: parse_config(
+            io.StringIO(small_config), msi_keymap
+        ),
+        "parse_config.huge": lambda: parse_config(io.StringIO(huge_config), msi_keymap),
+        "parse_color.hex": lambda: parse_color("12ab9F"),
+        "parse_color.name": lambda: parse_color("darkorange"),
+        "make_key_colors_packet": lambda: make_key_colors_packet("alphanum", alphanum),
+        "set_colors.full": set_colors_full,
+        "set_colors.unchanged": set_colors_unchanged,
+        "set_preset": set_preset,
+        "keyboard.load_keys": lambda: Keyboard.load_keys(BINDINGS_PATH),
+        "keyboard.save_keys": lambda: keyboard.save_keys(keys_path),
+        "keyboard.load_colors": lambda: keyboard.load_colors(DEFAULT_CONFIG_PATH),
+        "keyboard.save_colors": lambda: keyboard.save_colors(colors_path),
+    }
+
+
+def time_cli(tmp, only=None):
+    """({mode: best time}, {mode: error}) of the command line modes.
+
+    A mode exiting with an error is not timed, its error is the last line
+    it printed.
+    """
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        MSI_PERKEYRGB_BACKEND="sim",
+        # No daemon to forward commands to, and a cache of our own
+        XDG_RUNTIME_DIR=tmp,
+        XDG_CACHE_HOME=os.path.join(tmp, "cache"),
+    )
+    with open(DEFAULT_CONFIG_PATH, "rb") as f:
+        stdin_data = f.read()
+
+    results = {}
+    errors = {}
+    for mode, args in CLI_MODES.items():
+        if only and only not in "cli." + mode:
+            continue
+        cmd = [sys.executable, "-m", "msi_perkeyrgb_gui.main", "-m", MODEL] + args
+        times = []
+        for run in range(CLI_RUNS + 1):
+            start = perf_counter()
+            result = subprocess.run(
+                cmd,
+                env=env,
+                input=stdin_data,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=False,
+            )
+            elapsed = perf_counter() - start
+            if result.returncode != 0:
+                # Some errors are only printed on stdout
+                output = (result.stderr or result.stdout).decode(errors="replace")
+                output = output.strip()
+                errors["cli." + mode] = "exit status %d%s" % (
+                    result.returncode,
+                    " : " + output.splitlines()[-1] if output else "",
+                )
+                break
+            if run > 0:  # The first run fills the caches
+                times.append(elapsed)
+        else:
+            results["cli." + mode] = min(times)
+    return results, errors
+
+
+def run_suite(only=None):
+    """({benchmark: seconds}, {benchmark: error})"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func in library_benchmarks(tmp).items():
+            if only and only not in name:
+                continue
+            results[name] = time_call(func)
+            print("%-28s %12.2f us" % (name, results[name] * 1e6))
+        cli_results, errors = time_cli(tmp, only)
+        for name, seconds in cli_results.items():
+            results[name] = seconds
+            print("%-28s %12.2f us" % (name, seconds * 1e6))
+        for name, error in errors.items():
+            print("%-28s %12s    %s" % (name, "ERROR", error))
+    return results, errors
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratio to the baseline of each benchmark, returns the regressions"""
+    regressions = []
+    print("\n%-28s %12s %12s %8s" % ("benchmark", "baseline us", "current us", "ratio"))
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            "%-28s %12.2f %12.2f %8.2f%s"
+            % (name, baseline[name] * 1e6, seconds * 1e6, ratio, flag)
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-o", "--output", metavar="FILE", help="Write the results as JSON to FILE."
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="Compare against results previously written with --output.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Slowdown allowed against the baseline before failing (default %.2f)."
+        % DEFAULT_TOLERANCE,
+    )
+    parser.add_argument(
+        "-k", metavar="SUBSTRING", help="Only run benchmarks whose name contains it."
+    )
+    args = parser.parse_args()
+
+    results, errors = run_suite(args.k)
+
+    if args.output:
+        report = {
+            "version": __version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "unit": "seconds",
+            "results": results,
+            "errors": errors,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n%d regressions : %s" % (len(regressions), ", ".join(regressions)))
+            sys.exit(1)
+
+    if errors:
+        print("\n%d benchmarks failed : %s" % (len(errors), ", ".join(errors)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
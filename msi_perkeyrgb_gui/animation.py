@@ -0,0 +1,194 @@
+import colorsys
+import logging
+import math
+from time import monotonic, sleep
+
+from .metrics import get_metrics
+from .protocol_data.keycodes import REGION_KEYCODES
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FPS = 20
+
+# Reports sent for a frame touching every region : one per region plus the refresh
+REPORTS_PER_FRAME = len(REGION_KEYCODES) + 1
+# Share of the frame time the reports may take, the rest absorbs jitter
+FPS_HEADROOM = 0.9
+
+
+def max_fps(kb):
+    """Highest frame rate the controller allows for full keyboard frames.
+
+    Each report takes its send latency plus the pacing gap, and frames are
+    kept FPS_HEADROOM below that so that they can meet their deadlines.
+    """
+    pacer = kb.pacer
+    if pacer.min_gap <= 0:
+        return math.inf
+    report_time = pacer.min_gap + pacer.latency
+    return FPS_HEADROOM / (report_time * REPORTS_PER_FRAME)
+
+
+class AnimationStats:
+    def __init__(self):
+        self.frames = 0
+        self.missed_deadlines = 0
+        self.skipped_frames = 0
+        self.max_lateness = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def achieved_fps(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.frames / self.elapsed
+
+    def __str__(self):
+        return (
+            "%d frames in %.2fs (%.1f fps), %d missed deadlines, "
+            "%d skipped frames, max lateness %.1f ms"
+            % (
+                self.frames,
+                self.elapsed,
+                self.achieved_fps,
+                self.missed_deadlines,
+                self.skipped_frames,
+                self.max_lateness * 1000,
+            )
+        )
+
+
+class FrameClock:
+    """Frame deadlines on a fixed grid anchored at the start time.
+
+    Deadlines are computed from the frame index rather than from the end of
+    the previous frame, so that sleep and send jitter does not accumulate.
+    When the device falls behind, frames that can no longer be on time are
+    skipped instead of being sent late one after the other.
+    """
+
+    def __init__(self, fps, clock=monotonic, sleep=sleep):
+        self.interval = 1 / fps
+        self._clock = clock
+        self._sleep = sleep
+        self._start = None
+        self.frame = 0
+
+    def start(self):
+        self._start = self._clock()
+        self.frame = 0
+        return self._start
+
+    @property
+    def deadline(self):
+        return self._start + self.frame * self.interval
+
+    @property
+    def timestamp(self):
+        """Time of the current frame relative to the start, for effects"""
+        return self.frame * self.interval
+
+    def now(self):
+        return self._clock() - self._start
+
+    def advance(self, stats):
+        """Move to the next frame and wait for its deadline.
+
+        A frame whose deadline has passed is sent right away. If it is late by
+        more than one interval, the frames in between are skipped.
+        """
+        now = self._clock()
+        self.frame += 1
+
+        lateness = now - self.deadline
+        if lateness > 0:
+            stats.missed_deadlines += 1
+            stats.max_lateness = max(stats.max_lateness, lateness)
+            skipped = int(lateness // self.interval)
+            stats.skipped_frames += skipped
+            metrics = get_metrics()
+            if metrics is not None:
+                metrics.add("frames_skipped", skipped)
+            self.frame += skipped
+        else:
+            self._sleep(-lateness)
+
+
+class Animator:
+    """Drives an effect on the keyboard at a target frame rate.
+
+    An effect is a callable taking the frame timestamp in seconds and
+    returning a {linux keycode: [r, g, b]} map, like MSIKeyboard.set_colors,
+    or a framebuffer.FrameBuffer.
+    The frame rate is capped to what the controller pacing allows.
+    """
+
+    def __init__(self, kb, effect, fps=DEFAULT_FPS, clock=monotonic, sleep=sleep):
+        self.kb = kb
+        self.effect = effect
+
+        limit = max_fps(kb)
+        if fps > limit:
+            log.warning(
+                "%.1f fps is above the controller limit, using %.1f fps", fps, limit
+            )
+            fps = limit
+
+        self.fps = fps
+        self.clock = FrameClock(fps, clock, sleep)
+        self.stats = AnimationStats()
+        self._running = False
+
+    def stop(self):
+        self._running = False
+
+    def run(self, duration=None, frames=None):
+        self._running = True
+        self.clock.start()
+
+        while self._running:
+            if duration is not None and self.clock.timestamp >= duration:
+                break
+            if frames is not None and self.stats.frames >= frames:
+                break
+
+            frame = self.effect(self.clock.timestamp)
+            if isinstance(frame, dict):
+                self.kb.set_colors(frame)
+            else:
+                self.kb.set_colors_array(frame.keycodes, frame.colors)
+            self.kb.refresh()
+            self.stats.frames += 1
+
+            self.clock.advance(self.stats)
+
+        self.stats.elapsed = self.clock.now()
+        self._running = False
+        return self.stats
+
+
+def rainbow_wave(msi_keymap, period=4.0, spread=0.02):
+    """Hue cycling effect, shifted along the Linux keycodes"""
+    keycodes = list(msi_keymap)
+
+    def effect(t):
+        colors_map = {}
+        for k in keycodes:
+            hue = (t / period + k * spread) % 1.0
+            r, g, b = colorsys.hsv_to_rgb(hue, 1.0, 1.0)
+            colors_map[k] = [int(r * 255), int(g * 255), int(b * 255)]
+        return colors_map
+
+    return effect
+
+
+def breathing(msi_keymap, color, period=3.0):
+    """Whole keyboard fading in and out of a single color"""
+    keycodes = list(msi_keymap)
+
+    def effect(t):
+        level = (1 - math.cos(2 * math.pi * t / period)) / 2
+        rgb = [int(c * level) for c in color]
+        return dict.fromkeys(keycodes, rgb)
+
+    return effect
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 from .parsing import parse_color
 
@@ -67,15 +68,17 @@ def parse_config(f, msi_keymap):
     colors_map = {}
     warnings = []
 
+    # Generated configs repeat the same keys and colors on many lines
+    keycodes_cache = {}
+
     for i, line in enumerate(f):
 
-        line = line.replace("\n", "")
+        parameters = [p for p in line.rstrip("\n").split(" ") if p]
 
-        if line.replace(" ", "")[0] == "#":
+        # Blank line or comment
+        if len(parameters) == 0 or parameters[0][0] == "#":
             continue
 
-        parameters = list(filter(None, line.split(" ")))
-
         if i == 0 and parameters[0] == "model":
             warnings += [
                 "Passing the laptop model in the configuration file is deprecated, use the --model option instead."
@@ -83,65 +86,120 @@ def parse_config(f, msi_keymap):
             continue
 
         # Parsing a keys/color line
-        if len(parameters) == 0:
-            continue
-        elif len(parameters) > 3:
+        if len(parameters) != 3:
             raise ConfigParseError(
                 "line %d: Invalid number of parameters (expected 3, got %d)"
                 % (i + 1, len(parameters))
             )
-        else:
 
-            try:
-                keycodes = parse_keycodes(msi_keymap, parameters[0])
-                parse_mode(parameters[1])
-                color = parse_config_color(parameters[2])
-            except LineParseError as e:
-                raise ConfigParseError("line %d : %s" % (i + 1, str(e))) from e
-            else:
-                colors_map = update_colors_map(colors_map, keycodes, color)
+        keys_parameter, mode_parameter, color_parameter = parameters
+        try:
+            keycodes = keycodes_cache.get(keys_parameter)
+            if keycodes is None:
+                keycodes = parse_keycodes(msi_keymap, keys_parameter)
+                keycodes_cache[keys_parameter] = keycodes
+            parse_mode(mode_parameter)
+            color = parse_config_color(color_parameter)
+        except LineParseError as e:
+            raise ConfigParseError("line %d : %s" % (i + 1, str(e))) from e
+        else:
+            colors_map = update_colors_map(colors_map, keycodes, color)
 
     return colors_map, warnings
 
 
+KEYCODE_RE = re.compile("[0-9]+")
+KEYCODE_RANGE_RE = re.compile("([0-9]+)-([0-9]+)")
+
+
 def parse_keycodes(msi_keymap, keys_parameter):
     keycodes = []
 
-    # Alias substitution
-    for alias in ALIASES.keys():
-        keys_parameter = keys_parameter.replace(alias, ALIASES[alias])
-
-    keys_ranges_list = keys_parameter.split(",")
-    for key_str in keys_ranges_list:
-
-        # Parsing
-        if re.fullmatch("^[0-9]+$", key_str):  # Single keycode
-            keycode = int(key_str)
-            if keycode not in msi_keymap.keys():
-                raise LineParseError("%s is not a valid keycode." % key_str)
-            else:
-                keycodes.append(keycode)
-        elif re.fullmatch("^[0-9]+-[0-9]+$", key_str):  # Keycode range
-            keycode_1, keycode_2 = [int(s) for s in key_str.split("-")]
-            if (
-                keycode_2 <= keycode_1
-                or keycode_1 not in msi_keymap.keys()
-                or keycode_2 not in msi_keymap.keys()
-            ):
-                raise LineParseError("%s is not a valid keycode range." % key_str)
-            else:
-                new_keycodes = [
-                    k for k in range(keycode_1, keycode_2 + 1) if k in msi_keymap.keys()
-                ]
-                keycodes += new_keycodes
+    for key_str in keys_parameter.split(","):
+        alias = ALIASES.get(key_str)
+        if alias is not None:
+            keycodes += parse_keycodes(msi_keymap, alias)
         else:
-            raise LineParseError(
-                "%s is not a keycode, nor a keycode range, nor an alias." % key_str
-            )
+            keycodes += _parse_keys_token(msi_keymap, key_str)
 
     return keycodes
 
 
+def _parse_keys_token(msi_keymap, key_str):
+
+    if KEYCODE_RE.fullmatch(key_str):  # Single keycode
+        keycode = int(key_str)
+        if keycode not in msi_keymap:
+            raise LineParseError("%s is not a valid keycode." % key_str)
+        return [keycode]
+
+    match = KEYCODE_RANGE_RE.fullmatch(key_str)
+    if match:  # Keycode range
+        keycode_1, keycode_2 = int(match.group(1)), int(match.group(2))
+        if (
+            keycode_2 <= keycode_1
+            or keycode_1 not in msi_keymap
+            or keycode_2 not in msi_keymap
+        ):
+            raise LineParseError("%s is not a valid keycode range." % key_str)
+        return [k for k in range(keycode_1, keycode_2 + 1) if k in msi_keymap]
+
+    raise LineParseError(
+        "%s is not a keycode, nor a keycode range, nor an alias." % key_str
+    )
+
+
+STREAM_CHUNK_SIZE = 4096
+MAX_FRAME_SIZE = 1 << 20  # bytes
+_FRAME_DELIMITERS = re.compile(b"[\n\0]")
+
+
+def read_config_frames(stream, max_frame_size=MAX_FRAME_SIZE):
+    """Yield the frames of a config stream, as text ready for parse_config.
+
+    Frames are separated by blank lines or by NUL characters. The stream is
+    read as data comes in, so a frame is yielded as soon as its delimiter is
+    received, and only the frame being read is kept in memory.
+    """
+    read = getattr(stream, "read1", stream.read)
+    pending = b""
+    lines = []
+    size = 0
+
+    def end_frame():
+        nonlocal lines, size
+        frame = b"\n".join(lines).decode(errors="replace") + "\n"
+        lines = []
+        size = 0
+        return frame
+
+    while True:
+        chunk = read(STREAM_CHUNK_SIZE)
+        eof = not chunk
+        pending += chunk
+
+        start = 0
+        for match in _FRAME_DELIMITERS.finditer(pending):
+            line = pending[start : match.start()]
+            start = match.end()
+            if line.strip():
+                lines.append(line)
+                size += len(line)
+            if (match.group() == b"\0" or not line.strip()) and lines:
+                yield end_frame()
+        pending = pending[start:]
+
+        if size + len(pending) > max_frame_size:
+            raise ConfigError("Frame larger than %d bytes" % max_frame_size)
+
+        if eof:
+            if pending.strip():
+                lines.append(pending)
+            if lines:
+                yield end_frame()
+            return
+
+
 # This is a stub because there is only one mode for now. Will be modified in future versions.
 def parse_mode(mode_parameter):
     if mode_parameter != "steady":
@@ -149,8 +207,13 @@ def parse_mode(mode_parameter):
 
 
 def parse_config_color(color_parameter):
+    return list(_parse_config_color(color_parameter))
+
+
+@lru_cache(maxsize=1024)
+def _parse_config_color(color_parameter):
     _color = parse_color(color_parameter)
-    return [int(_color[i : i + 2], 16) for i in [0, 2, 4]]
+    return tuple(int(_color[i : i + 2], 16) for i in [0, 2, 4])
 
 
 def update_colors_map(colors_map, keycodes, color):
@@ -0,0 +1,163 @@
+import hashlib
+import io
+import logging
+import os
+import struct
+
+from . import __version__
+from .config import parse_config, ConfigError, ConfigParseError
+from .msikeyboard import MSIKeyboard
+from .paths import cache_path
+
+log = logging.getLogger(__name__)
+
+CACHE_MAGIC = b"MSICC\x01"
+MAX_CACHE_SIZE = 1 << 20  # bytes
+
+
+class _PacketRecorder:
+    """Stands in for HID_Keyboard and keeps the reports instead of sending them"""
+
+    def __init__(self):
+        self.packets = []
+
+    def send_feature_report(self, data):
+        self.packets.append(bytes(data))
+
+    def send_output_report(self, data):
+        pass
+
+
+def compile_config(f, msi_keymap):
+    """Parse a config and build the region packets that apply it.
+
+    Returns (packets, warnings), packets being ready for MSIKeyboard.apply_packets.
+    """
+    colors_map, warnings = parse_config(f, msi_keymap)
+
+    recorder = _PacketRecorder()
+    kb = MSIKeyboard(None, msi_keymap, {}, hid_keyboard=recorder)
+    kb.set_colors(colors_map)
+
+    return recorder.packets, warnings
+
+
+def _pack(packets, warnings):
+    chunks = [CACHE_MAGIC, struct.pack("<H", len(warnings))]
+    for w in warnings:
+        data = w.encode()
+        chunks += [struct.pack("<H", len(data)), data]
+    chunks.append(struct.pack("<H", len(packets)))
+    for data in packets:
+        chunks += [struct.pack("<H", len(data)), data]
+    return b"".join(chunks)
+
+
+def _unpack(blob):
+    if not blob.startswith(CACHE_MAGIC):
+        raise ValueError("Not a compiled config")
+    offset = len(CACHE_MAGIC)
+
+    def read_chunks():
+        nonlocal offset
+        (count,) = struct.unpack_from("<H", blob, offset)
+        offset += 2
+        chunks = []
+        for _ in range(count):
+            (size,) = struct.unpack_from("<H", blob, offset)
+            offset += 2
+            chunks.append(blob[offset : offset + size])
+            offset += size
+        return chunks
+
+    warnings = [w.decode() for w in read_chunks()]
+    packets = read_chunks()
+    return packets, warnings
+
+
+class ConfigCache:
+    """Compiled configs on disk, keyed by config content, model and tool version.
+
+    When the cache grows above max_size bytes, the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, directory=None, max_size=MAX_CACHE_SIZE):
+        self.directory = directory or cache_path("configs")
+        self.max_size = max_size
+
+    @staticmethod
+    def key(content, msi_model):
+        h = hashlib.sha256()
+        h.update(("%s\0%s\0" % (__version__, msi_model)).encode())
+        h.update(content)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = _unpack(f.read())
+            os.utime(path)  # Marks the entry as recently used
+        except (OSError, ValueError, struct.error):
+            return None
+        return entry
+
+    def put(self, key, packets, warnings):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                f.write(_pack(packets, warnings))
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError as e:
+            log.warning("Cannot write config cache : %s", e)
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def load_compiled_config(config_path, msi_model, msi_keymap, cache=None):
+    """Same as config.load_config, but returns packets and goes through the cache"""
+    cache = cache or ConfigCache()
+    try:
+        with open(config_path, "rb") as f:
+            content = f.read()
+    except FileNotFoundError as e:
+        raise ConfigError("File %s does not exist" % config_path) from e
+    except IOError as e:
+        raise ConfigError("IOError : %s" % str(e)) from e
+
+    key = cache.key(content, msi_model)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
+    try:
+        packets, warnings = compile_config(io.StringIO(content.decode()), msi_keymap)
+    except ConfigParseError as e:
+        raise ConfigError("Parsing error : %s" % str(e)) from e
+    except Exception as e:
+        raise ConfigError("Unknown error : %s" % str(e)) from e
+
+    cache.put(key, packets, warnings)
+    return packets, warnings
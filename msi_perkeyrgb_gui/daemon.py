@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+from .config import load_steady, ConfigError, ConfigParseError
+from .config_cache import ConfigCache, load_compiled_config
+from .hidapi_wrapping import HIDNotFoundError, HIDOpenError, HIDSendError
+from .hotplug import REOPEN_TIMEOUT, HotplugMonitor
+from .ipc import DaemonError, default_socket_path, send_command
+from .metrics import get_metrics
+from .parsing import parse_preset, ColorParseError, UnknownPresetError
+
+log = logging.getLogger(__name__)
+
+# Seconds a client may stay silent, requests are served one at a time
+REQUEST_TIMEOUT = 1.0
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    timeout = REQUEST_TIMEOUT
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    reply = self.server.daemon.handle(request)
+                except ValueError as e:
+                    reply = {"ok": False, "error": "Invalid request : %s" % str(e)}
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+                self.wfile.flush()
+        except socket.timeout:
+            log.debug("Client silent for %.1fs, disconnected", REQUEST_TIMEOUT)
+
+
+class _UnixServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, daemon):
+        self.daemon = daemon
+        super().__init__(socket_path, _RequestHandler)
+
+
+class LightingDaemon:
+    """Keeps the keyboard and the model tables loaded, and applies commands
+    received from thin clients over a Unix domain socket.
+
+    Requests and replies are JSON objects, one per line. Every request has a
+    "cmd" field, and carries the "model" and "usb_id" the client was started
+    with, so that a client never drives a keyboard it was not meant for.
+
+    The keyboard is reopened with its last state when it reappears after an
+    unplug or a suspend, commands received meanwhile being part of that state.
+    """
+
+    def __init__(
+        self, kb, msi_model, usb_id, msi_keymap, msi_presets, socket_path=None
+    ):
+        self.kb = kb
+        self.msi_model = msi_model
+        self.usb_id = list(usb_id)
+        self.msi_keymap = msi_keymap
+        self.msi_presets = msi_presets
+        self.socket_path = socket_path or default_socket_path()
+        self.config_cache = ConfigCache()
+        # Requests and hotplug events come from different threads
+        self._kb_lock = threading.Lock()
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "Invalid request : not a JSON object"}
+        cmd = request.get("cmd")
+
+        if cmd == "ping":
+            return {"ok": True}
+
+        if cmd == "stats":
+            metrics = get_metrics()
+            if metrics is None:
+                return {"ok": False, "error": "Metrics are disabled, use --stats"}
+            return {"ok": True, "stats": metrics.snapshot()}
+
+        model = request.get("model", self.msi_model)
+        usb_id = request.get("usb_id", self.usb_id)
+        if model != self.msi_model or list(usb_id) != self.usb_id:
+            return {
+                "ok": False,
+                "mismatch": True,
+                "error": "Daemon is running for %s" % self.msi_model,
+            }
+
+        with self._kb_lock:
+            return self._apply(cmd, request)
+
+    def _apply(self, cmd, request):
+        # Other programs may have written to the keyboard since the daemon
+        # did, so the keys of a command are all sent, even those it thinks
+        # unchanged. Presets are always sent whole.
+        try:
+            if cmd == "disable":
+                self.kb.invalidate()
+                self.kb.set_color_all([0, 0, 0])
+            elif cmd == "steady":
+                colors_map, _ = load_steady(request["color"], self.msi_keymap)
+                self.kb.invalidate()
+                self.kb.set_colors(colors_map)
+            elif cmd == "preset":
+                preset = parse_preset(request["preset"], self.msi_presets)
+                self.kb.set_preset(preset)
+            elif cmd == "config":
+                packets, warnings = load_compiled_config(
+                    request["path"], self.msi_model, self.msi_keymap, self.config_cache
+                )
+                for w in warnings:
+                    log.warning("Warning: %s", w)
+                self.kb.invalidate()
+                self.kb.apply_packets(packets)
+            else:
+                return {"ok": False, "error": "Unknown command %s" % cmd}
+            self.kb.refresh()
+        except KeyError as e:
+            return {"ok": False, "error": "Missing parameter %s" % str(e)}
+        except (ConfigError, ConfigParseError, ColorParseError) as e:
+            return {"ok": False, "error": "Error reading config : %s" % str(e)}
+        except UnknownPresetError as e:
+            return {"ok": False, "error": "Unknown preset %s" % str(e)}
+        except HIDSendError:
+            pass  # Handled below, the keyboard is disconnected
+
+        if not self.kb.connected:
+            # Stale handle after a suspend, or keyboard unplugged : the state,
+            # this command included, is replayed once it can be opened again
+            try:
+                self.kb.reopen()
+            except (HIDNotFoundError, HIDOpenError, HIDSendError):
+                return {
+                    "ok": False,
+                    "error": "Keyboard disconnected, the command will be "
+                    "applied when it is back",
+                }
+
+        return {"ok": True}
+
+    def keyboard_added(self, added_paths):
+        with self._kb_lock:
+            if self.kb.connected:
+                return
+            try:
+                self.kb.reopen(REOPEN_TIMEOUT)
+            except (HIDNotFoundError, HIDOpenError, HIDSendError) as e:
+                log.warning("Cannot reopen keyboard : %s", e)
+            else:
+                log.info("Keyboard reopened and state restored")
+
+    def keyboard_removed(self, removed_paths):
+        with self._kb_lock:
+            self.kb.disconnect(removed_paths)
+
+    def serve_forever(self):
+        try:
+            if send_command({"cmd": "ping"}, self.socket_path) is not None:
+                raise DaemonError(
+                    "A daemon is already listening on %s" % self.socket_path
+                )
+        except (OSError, ValueError):
+            pass
+
+        # Socket file left over by a daemon that did not exit cleanly
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        server = _UnixServer(self.socket_path, self)
+        os.chmod(self.socket_path, 0o600)
+        log.info("Listening on %s", self.socket_path)
+        monitor = HotplugMonitor(
+            self.usb_id, self.keyboard_added, self.keyboard_removed
+        ).start()
+        try:
+            server.serve_forever()
+        finally:
+            monitor.stop()
+            server.server_close()
+            os.unlink(self.socket_path)
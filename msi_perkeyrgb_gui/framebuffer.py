@@ -0,0 +1,112 @@
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError(
+        "NumPy is needed for frame buffers, install it with "
+        '"pip install msi-perkeyrgb-gui[numpy]"'
+    ) from e
+
+from .msiprotocol import (
+    HEADER_LEN,
+    KEY_COLORS_PACKET_LEN,
+    KEY_FRAGMENT_LEN,
+    KEYCODE_OFFSET,
+    MODE_OFFSET,
+    MODE_STATIC,
+    NB_KEYS,
+)
+from .protocol_data.keycodes import REGION_KEYCODES
+
+REGIONS = list(REGION_KEYCODES)
+
+
+class LayoutArrays:
+    """ModelLayout tables as arrays indexed by Linux keycode, -1 for unknown keys"""
+
+    def __init__(self, layout):
+        size = len(layout.linux_slots)
+        self.region_index = np.full(size, -1, dtype=np.intp)
+        self.slot = np.zeros(size, dtype=np.intp)
+        self.msi_keycode = np.zeros(size, dtype=np.uint8)
+
+        # Linux keycodes of the model, in MSI slot order
+        keycodes = []
+        for linux_keycode, key_slot in enumerate(layout.linux_slots):
+            if key_slot is None:
+                continue
+            self.region_index[linux_keycode] = REGIONS.index(key_slot.region)
+            self.slot[linux_keycode] = key_slot.slot
+            self.msi_keycode[linux_keycode] = key_slot.keycode
+            keycodes.append(linux_keycode)
+
+        order = np.lexsort((self.slot[keycodes], self.region_index[keycodes]))
+        self.keycodes = np.array(keycodes, dtype=np.intp)[order]
+
+
+@lru_cache(maxsize=None)
+def layout_arrays(layout):
+    return LayoutArrays(layout)
+
+
+class FrameBuffer:
+    """Colors of every key of a model, as a (n_keys, 3) uint8 array in MSI slot order.
+
+    Apply it with kb.set_colors_array(frame.keycodes, frame.colors).
+    """
+
+    def __init__(self, layout):
+        self.keycodes = layout_arrays(layout).keycodes
+        self.colors = np.zeros((len(self.keycodes), 3), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.keycodes)
+
+
+def frame_fragments(frame, nb_regions):
+    """(nb_regions, NB_KEYS, KEY_FRAGMENT_LEN) view on consecutive region packets"""
+    packets = np.frombuffer(frame, dtype=np.uint8).reshape(
+        nb_regions, KEY_COLORS_PACKET_LEN
+    )
+    fragments = packets[:, HEADER_LEN : HEADER_LEN + NB_KEYS * KEY_FRAGMENT_LEN]
+    return fragments.reshape(nb_regions, NB_KEYS, KEY_FRAGMENT_LEN)
+
+
+def scatter_colors(fragments, layout, linux_keycodes, colors):
+    """Write steady colors into the region packets, returns the changed regions"""
+    arrays = layout_arrays(layout)
+    keycodes = np.asarray(linux_keycodes, dtype=np.intp)
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+
+    unknown = (keycodes < 0) | (keycodes >= len(arrays.region_index))
+    unknown[~unknown] = arrays.region_index[keycodes[~unknown]] < 0
+    if unknown.any():
+        raise KeyError(int(keycodes[unknown][0]))
+
+    regions = arrays.region_index[keycodes]
+    slots = arrays.slot[keycodes]
+    msi_keycodes = arrays.msi_keycode[keycodes]
+
+    current = fragments[regions, slots]
+    changed = (
+        (current[:, :3] != colors).any(axis=1)
+        | (current[:, MODE_OFFSET] != MODE_STATIC)
+        | (current[:, KEYCODE_OFFSET] != msi_keycodes)
+    )
+    if not changed.any():
+        return set()
+
+    regions, slots = regions[changed], slots[changed]
+    fragments[regions, slots] = 0
+    fragments[regions, slots, :3] = colors[changed]
+    fragments[regions, slots, MODE_OFFSET] = MODE_STATIC
+    fragments[regions, slots, KEYCODE_OFFSET] = msi_keycodes[changed]
+
+    return {REGIONS[i] for i in np.unique(regions)}
+
+
+def random_frame(layout):
+    keycodes = layout_arrays(layout).keycodes
+    colors = np.random.randint(0, 256, size=(len(keycodes), 3), dtype=np.uint8)
+    return keycodes, colors
@@ -21,6 +21,9 @@ class BaseHandler:
     def image_release(self, obj, button):
         pass
 
+    def image_motion(self, obj, motion):
+        pass
+
     def key_press(self, obj, button):
         pass
 
@@ -1,22 +1,58 @@
 import logging
+import math
 import os
-import sys
+from functools import lru_cache
 
-from gi.repository import Gdk
+import cairo
+from gi.repository import Gdk, GLib
 
 from .base import BaseHandler
 from .open_file_dialog import OpenFileDialog
 from .save_file_dialog import SaveFileDialog
-from ..config import load_config, ConfigError
+from ..config import ConfigError
+from ..config_cache import load_compiled_config
+from ..hidapi_wrapping import selected_backend
+from ..hotplug import HotplugMonitor
+from ..ipc import DaemonError, send_command
 from ..keyboard import Keyboard
 from ..msikeyboard import MSIKeyboard
+from ..pacing import get_model_min_gap
 from ..parsing import parse_usb_id, UnknownIdError
+from ..writer import KeyboardWriter
 
 log = logging.getLogger(__name__)
 GDK_CONTROL_MASK = 4
+DRAG_THRESHOLD = 4  # pixels moved before a click becomes a rectangle selection
+OUTLINE_WIDTH = 2
 
 
-def update_kb(model, usb_id, config):
+@lru_cache(maxsize=None)
+def color_to_rgb(color):
+    """"rrggbb" to cairo (r, g, b) floats"""
+    return tuple(int(color[i : i + 2], 16) / 255.0 for i in [0, 2, 4])
+
+
+def update_kb_through_daemon(model, usb_id, config):
+    request = {
+        "cmd": "config",
+        "path": os.path.abspath(config),
+        "model": model,
+        "usb_id": list(parse_usb_id(usb_id)),
+    }
+    try:
+        reply = send_command(request)
+    except (OSError, ValueError, DaemonError, UnknownIdError) as e:
+        log.warning("Daemon did not answer, applying directly: %s", e)
+        return False
+
+    if reply is None or reply.get("mismatch"):
+        return False
+    if not reply["ok"]:
+        log.error("Daemon error: %s", reply["error"])
+    return True
+
+
+def open_keyboard(model, usb_id, device=None):
     msi_presets = MSIKeyboard.get_model_presets(model)
     msi_keymap = MSIKeyboard.get_model_keymap(model)
 
@@ -24,34 +60,80 @@ def update_kb(model, usb_id, config):
         parsed_usb_id = parse_usb_id(usb_id)
     except UnknownIdError:
         log.error(f"Unknown vendor/product ID: %s", usb_id)
-        sys.exit(1)
+        return None
 
-    kb = MSIKeyboard.get(parsed_usb_id, msi_keymap, msi_presets)
-    if not kb:
-        sys.exit(1)
+    return MSIKeyboard.get(
+        parsed_usb_id, msi_keymap, msi_presets, get_model_min_gap(model), device
+    )
 
-    try:
-        colors_map, warnings = load_config(config, msi_keymap)
-    except ConfigError as e:
-        log.error("Error reading config file: %s", e)
-        sys.exit(1)
 
-    for w in warnings:
-        log.error("Warning: %s", w)
+def update_kb(writer, model, usb_id, config, device=None):
+    """Apply a config file to the keyboard, run on the writer thread.
+
+    Returns the config warnings. The daemon, driving the first keyboard
+    found, is not used for a given device or the simulated keyboard. Nor
+    is it once the writer has opened the keyboard for live preview, as the
+    preview and the daemon would both write to it, each with its own idea
+    of the key colors.
+    """
+    if (
+        device is None
+        and writer.kb is None
+        and selected_backend() == "hidapi"
+        and update_kb_through_daemon(model, usb_id, config)
+    ):
+        return []
+
+    msi_keymap = MSIKeyboard.get_model_keymap(model)
+    packets, warnings = load_compiled_config(config, model, msi_keymap)
 
-    kb.set_colors(colors_map)
+    kb = writer.keyboard()
+    kb.apply_packets(packets)
     kb.refresh()
+    return warnings
 
 
 class ConfigHandler(BaseHandler):
     current_key = None
+    selection = []
+    drag_start = None
+    drag_end = None
+    _overlay = None
 
-    def __init__(self, model, image, color_selector, colors_filename, usb_id):
+    def __init__(
+        self,
+        model,
+        image,
+        color_selector,
+        colors_filename,
+        usb_id,
+        live_preview=True,
+        device=None,
+    ):
         super().__init__(model)
         self.image = image
         self.color_selector = color_selector
         self.colors_filename = os.path.abspath(colors_filename)
         self.usb_id = usb_id
+        self.device = device
+
+        # Keyboard I/O runs on the writer thread, with the keyboard opened
+        # once on first use and kept open afterwards, or reopened if unplugged
+        self.writer = KeyboardWriter(
+            open_keyboard=lambda: open_keyboard(self.model, self.usb_id, self.device)
+        ).start()
+        try:
+            HotplugMonitor(
+                parse_usb_id(usb_id), self.writer.reconnect, self.writer.disconnect
+            ).start()
+        except UnknownIdError:
+            pass  # Reported when opening the keyboard
+        self._update_queued = False
+
+        # Colors being picked are sent to the keyboard right away
+        self.live_preview = live_preview
+        self._msi_keymap = MSIKeyboard.get_model_keymap(model)
+        self._preview_started = False
 
         self.image.connect("draw", self.expose)
         self.keyboard = Keyboard.load_keys(self.bindings_path)
@@ -61,34 +143,117 @@ class ConfigHandler(BaseHandler):
         if not os.path.isfile(self.colors_filename):
             self.keyboard.save_colors(self.colors_filename)
 
+    def overlay(self):
+        """Offscreen surface with every key painted, updated key by key"""
+        if self._overlay is None:
+            width = max((key.box[1][0] for key in self.keyboard), default=0)
+            height = max((key.box[1][1] for key in self.keyboard), default=0)
+            self._overlay = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32, int(width) + 1, int(height) + 1
+            )
+            self._overlay_context = cairo.Context(self._overlay)
+            for key in self.keyboard:
+                self.paint_key(key)
+        return self._overlay
+
+    def paint_key(self, key):
+        box = key.box
+        context = self._overlay_context
+        context.set_source_rgb(*color_to_rgb(key.color))
+        context.rectangle(*box[0], box[1][0] - box[0][0], box[1][1] - box[0][1])
+        context.fill()
+
+    def queue_draw_rect(self, x0, y0, x1, y1):
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        x0 = math.floor(x0) - OUTLINE_WIDTH
+        y0 = math.floor(y0) - OUTLINE_WIDTH
+        x1 = math.ceil(x1) + OUTLINE_WIDTH
+        y1 = math.ceil(y1) + OUTLINE_WIDTH
+        self.image.queue_draw_area(x0, y0, x1 - x0, y1 - y0)
+
+    def redraw_keys(self, keys, repaint=False):
+        """Redraw the boxes of keys, repainting them first if their color changed"""
+        for key in keys:
+            if repaint and self._overlay is not None:
+                self.paint_key(key)
+            self.queue_draw_rect(*key.box[0], *key.box[1])
+
+    def redraw_all(self):
+        self._overlay = None
+        self.image.queue_draw()
+
     def expose(self, area, context):
-        for key in self.keyboard:
+        # Only the areas queued for redraw are actually painted
+        context.set_source_surface(self.overlay(), 0, 0)
+        context.paint()
+
+        # Outline of the selected keys, and of the rectangle being dragged
+        context.set_source_rgb(1, 1, 1)
+        context.set_line_width(OUTLINE_WIDTH)
+        for key in self.selection:
             box = key.box
-            color = key.color
-            context.set_source_rgb(
-                int(color[:2], 16) / 255.0,
-                int(color[2:4], 16) / 255.0,
-                int(color[4:], 16) / 255.0,
-            )
             context.rectangle(*box[0], box[1][0] - box[0][0], box[1][1] - box[0][1])
-            context.fill()
+        context.stroke()
+        if self.drag_end:
+            (x0, y0), (x1, y1) = self.drag_start, self.drag_end
+            context.set_dash([4, 4])
+            context.rectangle(x0, y0, x1 - x0, y1 - y0)
+            context.stroke()
+            context.set_dash([])
+
+    def select(self, keys):
+        """Make keys the ones edited by the color selector"""
+        self.redraw_keys(self.selection)
+        self.current_key = keys[0] if keys else None
+        # Showing the color of the first key must not recolor the others
+        self.selection = []
+        if self.current_key:
+            color = self.current_key.color
+            self.color_selector.set_current_rgba(
+                Gdk.RGBA(
+                    int(color[:2], 16) / 255.0,
+                    int(color[2:4], 16) / 255.0,
+                    int(color[4:], 16) / 255.0,
+                    1,
+                )
+            )
+        self.selection = keys
+        self.redraw_keys(keys)
 
     def image_press(self, obj, button):
+        if button.button != 1:
+            return
+        self.drag_start = (button.x, button.y)
+        self.drag_end = None
+
         key = self.keyboard.get_xy(button.x, button.y)
         if not key:
             return
         log.info("Choose key %r: #%s", key.name, key.color.upper())
-        self.current_key = key
-        color = key.color
-
-        self.color_selector.set_current_rgba(
-            Gdk.RGBA(
-                int(color[:2], 16) / 255.0,
-                int(color[2:4], 16) / 255.0,
-                int(color[4:], 16) / 255.0,
-                1,
-            )
-        )
+        self.select([key])
+
+    def image_motion(self, obj, motion):
+        if not self.drag_start:
+            return
+        x0, y0 = self.drag_start
+        moved = max(abs(motion.x - x0), abs(motion.y - y0))
+        if self.drag_end or moved > DRAG_THRESHOLD:
+            previous = self.drag_end or (motion.x, motion.y)
+            self.drag_end = (motion.x, motion.y)
+            xs = (x0, previous[0], motion.x)
+            ys = (y0, previous[1], motion.y)
+            self.queue_draw_rect(min(xs), min(ys), max(xs), max(ys))
+
+    def image_release(self, obj, button):
+        if button.button != 1 or not self.drag_start:
+            return
+        if self.drag_end:
+            self.queue_draw_rect(*self.drag_start, *self.drag_end)
+            keys = self.keyboard.get_rect(*self.drag_start, button.x, button.y)
+            log.info("Choose %d keys", len(keys))
+            self.select(keys)
+        self.drag_start = self.drag_end = None
 
     def key_press(self, obj, button):
         keycode = button.hardware_keycode
@@ -102,7 +267,7 @@ class ConfigHandler(BaseHandler):
             elif keycode == 52 or key.name == "x":
                 log.info(f"Load colors from: {self.colors_filename}")
                 self.keyboard.load_colors(self.colors_filename)
-                self.image.queue_draw()
+                self.redraw_all()
             elif keycode == 32 or key.name == "o":
                 self.config_open(window)
             else:
@@ -115,8 +280,35 @@ class ConfigHandler(BaseHandler):
 
     def config_save(self, obj):
         self.keyboard.save_colors(self.colors_filename)
-        update_kb(self.model, self.usb_id, self.colors_filename)
         log.info(f"Config saved to: {self.colors_filename}")
+        self.update_kb()
+
+    def update_kb(self):
+        # An update still waiting for the writer will read the file just saved
+        if self._update_queued:
+            return
+        self._update_queued = True
+        config = self.colors_filename
+
+        def update():
+            self._update_queued = False
+            return update_kb(self.writer, self.model, self.usb_id, config, self.device)
+
+        def on_done(warnings, error):
+            GLib.idle_add(self.kb_updated, config, warnings, error)
+
+        self.writer.call(update, on_done)
+
+    def kb_updated(self, config, warnings, error):
+        if isinstance(error, ConfigError):
+            log.error("Error reading config file: %s", error)
+        elif error is not None:
+            log.error("Cannot update keyboard: %s", error)
+        else:
+            for w in warnings:
+                log.error("Warning: %s", w)
+            log.info(f"Keyboard updated from: {config}")
+        return False  # Called once by GLib.idle_add
 
     def config_save_as(self, obj):
         file_path = SaveFileDialog.open(obj)
@@ -131,7 +323,7 @@ class ConfigHandler(BaseHandler):
             self.colors_filename = file_path
 
             self.keyboard.load_colors(self.colors_filename)
-            self.image.queue_draw()
+            self.redraw_all()
             log.info(f"Config file opened: {self.colors_filename}")
 
     def color_changed(self, color_selection):
@@ -143,7 +335,39 @@ class ConfigHandler(BaseHandler):
         ]
         text = "".join("%0.2X" % i for i in rgb).lower()
 
-        if self.current_key and self.current_key.color != text:
-            log.info(f"New color for %r: #%s", self.current_key.name, text.upper())
-            self.current_key.color = text
-            self.image.queue_draw()
+        keys = self.selection or ([self.current_key] if self.current_key else [])
+        keys = [key for key in keys if key.color != text]
+        if not keys:
+            return
+
+        if len(keys) == 1:
+            log.info(f"New color for %r: #%s", keys[0].name, text.upper())
+        else:
+            log.info(f"New color for %d keys: #%s", len(keys), text.upper())
+        for key in keys:
+            key.color = text
+        self.redraw_keys(keys, repaint=True)
+        if self.live_preview:
+            self.preview_keys(keys, rgb)
+
+    def preview_keys(self, keys, rgb):
+        """Send the color of keys to the keyboard without saving.
+
+        The writer merges the colors picked while a send is in flight, so a
+        color picker drag only sends the latest color, as fast as the report
+        pacing allows, and only the regions holding the keys are sent again.
+        """
+        colors_map = {}
+        if not self._preview_started:
+            # The keyboard may not show what the GUI shows yet, send everything once
+            self._preview_started = True
+            for k in self.keyboard:
+                if k.keycode in self._msi_keymap:
+                    colors_map[k.keycode] = [
+                        int(k.color[i : i + 2], 16) for i in [0, 2, 4]
+                    ]
+        for key in keys:
+            if key.keycode in self._msi_keymap:
+                colors_map[key.keycode] = rgb
+        if colors_map:
+            self.writer.submit(colors_map)
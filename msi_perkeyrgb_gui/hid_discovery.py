@@ -0,0 +1,101 @@
+import os
+import re
+from collections import namedtuple
+
+SYSFS_HID_DEVICES = "/sys/bus/hid/devices"
+
+# Sysfs HID device names look like "0003:1038:1122.0001" (bus:vendor:product.instance)
+SYSFS_HID_NAME_RE = re.compile(r"^[0-9A-F]{4}:([0-9A-F]{4}):([0-9A-F]{4})\.[0-9A-F]+$")
+
+HIDDevice = namedtuple("HIDDevice", ["vid", "pid", "path", "serial"])
+
+
+def _read_hid_uevent(device_dir):
+    uevent = {}
+    try:
+        with open(os.path.join(device_dir, "uevent")) as f:
+            for line in f:
+                key, _, value = line.rstrip("\n").partition("=")
+                uevent[key] = value
+    except OSError:
+        pass
+    return uevent
+
+
+def _scan_sysfs(usb_id):
+    devices = []
+    for name in sorted(os.listdir(SYSFS_HID_DEVICES)):
+        match = SYSFS_HID_NAME_RE.match(name)
+        if not match:
+            continue
+        vid, pid = int(match.group(1), 16), int(match.group(2), 16)
+        if usb_id and (vid, pid) != tuple(usb_id):
+            continue
+
+        device_dir = os.path.join(SYSFS_HID_DEVICES, name)
+        serial = _read_hid_uevent(device_dir).get("HID_UNIQ") or None
+        try:
+            hidraw_names = sorted(os.listdir(os.path.join(device_dir, "hidraw")))
+        except OSError:
+            hidraw_names = []
+
+        for hidraw_name in hidraw_names:
+            devices.append(HIDDevice(vid, pid, "/dev/" + hidraw_name, serial))
+
+    return devices
+
+
+def enumerate_hidapi(usb_id, hidapi):
+    """List HID devices through hid_enumerate, in the order hid_open picks them"""
+    vid, pid = usb_id if usb_id else (0, 0)
+    devices = []
+
+    head = hidapi.hid_enumerate(vid, pid)
+    info = head
+    while info:
+        devices.append(
+            HIDDevice(
+                info.contents.vendor_id,
+                info.contents.product_id,
+                info.contents.path.decode(),
+                info.contents.serial_number or None,
+            )
+        )
+        info = info.contents.next
+    hidapi.hid_free_enumeration(head)
+
+    return devices
+
+
+def find_hid_devices(usb_id=None, hidapi=None):
+    """List HID devices matching the (vendor id, product id) pair, or all of them.
+
+    Reads sysfs directly, without spawning lsusb or loading any library.
+    hid_enumerate is only used on systems without /sys/bus/hid.
+    """
+    if os.path.isdir(SYSFS_HID_DEVICES):
+        return _scan_sysfs(usb_id)
+    if hidapi is not None:
+        return enumerate_hidapi(usb_id, hidapi)
+    return []
+
+
+def select_hid_device(devices, device):
+    """The device whose hidraw path or serial number is device, None if missing"""
+    for hid_device in devices:
+        if device in (hid_device.path, hid_device.serial):
+            return hid_device
+    return None
+
+
+def describe_permissions(path):
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        return "not accessible (%s)" % e.strerror
+
+    access = "".join(
+        flag if os.access(path, mask) else "-"
+        for flag, mask in (("r", os.R_OK), ("w", os.W_OK))
+    )
+    return "mode %o, %s for current user" % (mode & 0o777, access)
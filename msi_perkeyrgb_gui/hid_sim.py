@@ -0,0 +1,192 @@
+import logging
+import os
+from collections import deque, namedtuple
+from time import monotonic, sleep
+
+from .msiprotocol import (
+    COLOR_SHIFT,
+    EFFECT_ID_OFFSET,
+    HEADER_LEN,
+    KEY_FRAGMENT_LEN,
+    KEYCODE_OFFSET,
+    MODE_OFFSET,
+    MODE_STATIC,
+    NB_KEYS,
+    REGION_ID_OFFSET,
+    REGIONS_BY_ID_CODE,
+    START_COLOR_OFFSET,
+    TOTAL_DURATION_OFFSET,
+    TRANSITION_COUNT_OFFSET,
+    TRANSITION_LEN,
+    TRANSITIONS_OFFSET,
+    WAVE_INWARD_OFFSET,
+    WAVE_OFFSET,
+)
+
+log = logging.getLogger(__name__)
+
+# Timing model of the simulated controller, overridden by these variables (in ms)
+SIM_LATENCY = 0.0005
+SIM_MIN_GAP = 0.005
+SIM_LATENCY_ENV = "MSI_PERKEYRGB_SIM_LATENCY_MS"
+SIM_MIN_GAP_ENV = "MSI_PERKEYRGB_SIM_MIN_GAP_MS"
+SIM_STRICT_ENV = "MSI_PERKEYRGB_SIM_STRICT"
+SIM_LOG_SIZE = 10000
+
+# One entry of the simulator log. kind is "colors", "effect", "refresh" or
+# "unknown", dropped tells that the report came too soon and was ignored.
+SimReport = namedtuple("SimReport", ["time", "kind", "size", "dropped"])
+
+# Key states : a steady color, or the id of an effect
+SteadyKey = namedtuple("SteadyKey", ["region", "color"])
+EffectKey = namedtuple("EffectKey", ["region", "effect_id"])
+
+# Effect as decoded from a 0x0b report, colors and deltas being 12.4 fixed point
+SimTransition = namedtuple("SimTransition", ["delta", "duration"])
+SimEffect = namedtuple(
+    "SimEffect", ["start_color", "transitions", "total_duration", "wave", "inward"]
+)
+
+
+def _u16(data, offset):
+    return data[offset] | (data[offset + 1] << 8)
+
+
+def _s8(value):
+    return value - 0x100 if value & 0x80 else value
+
+
+def decode_key_colors(data):
+    """{MSI keycode: key state} of a 0x0e report"""
+    region = REGIONS_BY_ID_CODE.get(data[REGION_ID_OFFSET])
+    keys = {}
+    for slot in range(NB_KEYS):
+        offset = HEADER_LEN + slot * KEY_FRAGMENT_LEN
+        keycode = data[offset + KEYCODE_OFFSET]
+        if keycode == 0:  # Padding
+            continue
+        if data[offset + MODE_OFFSET] == MODE_STATIC:
+            keys[keycode] = SteadyKey(region, tuple(data[offset : offset + 3]))
+        else:
+            keys[keycode] = EffectKey(region, data[offset + EFFECT_ID_OFFSET])
+    return keys
+
+
+def decode_effect(data):
+    """(effect id, SimEffect) of a 0x0b report"""
+    transitions = []
+    for i in range(data[TRANSITION_COUNT_OFFSET]):
+        offset = TRANSITIONS_OFFSET + i * TRANSITION_LEN
+        delta = tuple(_s8(data[offset + 2 + channel]) for channel in range(3))
+        transitions.append(SimTransition(delta, _u16(data, offset + 6)))
+
+    start_color = tuple(
+        _u16(data, START_COLOR_OFFSET + 2 * channel) >> COLOR_SHIFT
+        for channel in range(3)
+    )
+    wave = tuple(_u16(data, WAVE_OFFSET + 2 * i) for i in range(5))
+    effect = SimEffect(
+        start_color,
+        transitions,
+        _u16(data, TOTAL_DURATION_OFFSET),
+        wave if any(wave) else None,
+        bool(data[WAVE_INWARD_OFFSET]),
+    )
+    return data[TRANSITIONS_OFFSET], effect
+
+
+class SimulatedKeyboard:
+    """HID backend standing in for the RGB controller, see HidapiBackend.
+
+    Reports are decoded into a virtual state : keys and effects sent since
+    the last refresh are pending, and become visible on the next 0x09
+    report. Every report takes `latency` seconds. A report sent less than
+    `min_gap` seconds after the previous one completed is ignored, the way
+    the controller derps when commands come too fast, and counted in
+    `dropped`. The real controller gives no sign of it, but in `strict` mode
+    the send fails, making HID_Keyboard raise HIDSendError. Reports are
+    logged with a timestamp in `log` (the last SIM_LOG_SIZE ones).
+    """
+
+    path = None
+
+    def __init__(
+        self,
+        latency=SIM_LATENCY,
+        min_gap=SIM_MIN_GAP,
+        strict=False,
+        clock=monotonic,
+        sleep=sleep,
+    ):
+        self.latency = latency
+        self.min_gap = min_gap
+        self.strict = strict
+        self._clock = clock
+        self._sleep = sleep
+        self._last_report = None
+
+        self.pending_keys = {}
+        self.pending_effects = {}
+        self.keys = {}
+        self.effects = {}
+        self.log = deque(maxlen=SIM_LOG_SIZE)
+        self.reports = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls):
+        latency = os.environ.get(SIM_LATENCY_ENV)
+        min_gap = os.environ.get(SIM_MIN_GAP_ENV)
+        return cls(
+            SIM_LATENCY if latency is None else float(latency) / 1000,
+            SIM_MIN_GAP if min_gap is None else float(min_gap) / 1000,
+            os.environ.get(SIM_STRICT_ENV, "0") not in ("", "0"),
+        )
+
+    def colors(self):
+        """{MSI keycode: (r, g, b)} of the visible steady keys"""
+        return {
+            keycode: key.color
+            for keycode, key in self.keys.items()
+            if isinstance(key, SteadyKey)
+        }
+
+    def _report(self, data):
+        data = bytes(data)
+        start = self._clock()
+        dropped = (
+            self._last_report is not None
+            and start - self._last_report < self.min_gap
+        )
+        if self.latency > 0:
+            self._sleep(self.latency)
+        self._last_report = self._clock()
+
+        kind = {0x0e: "colors", 0x0b: "effect", 0x09: "refresh"}.get(data[0], "unknown")
+        self.log.append(SimReport(start, kind, len(data), dropped))
+        self.reports += 1
+        if dropped:
+            self.dropped += 1
+            log.debug("Simulated keyboard ignored a %s report sent too fast", kind)
+            if self.strict:
+                return -1
+        elif kind == "colors":
+            self.pending_keys.update(decode_key_colors(data))
+        elif kind == "effect":
+            effect_id, effect = decode_effect(data)
+            self.pending_effects[effect_id] = effect
+        elif kind == "refresh":
+            self.keys.update(self.pending_keys)
+            self.effects.update(self.pending_effects)
+            self.pending_keys = {}
+            self.pending_effects = {}
+        return len(data)
+
+    def send_feature_report(self, data):
+        return self._report(data)
+
+    def write(self, data):
+        return self._report(data)
+
+    def close(self):
+        pass
@@ -3,6 +3,25 @@ import ctypes as ct
 # Courtesy of https://github.com/apmorton/pyhidapi/issues/16
 
 
+class DeviceInfo(ct.Structure):
+    pass
+
+
+DeviceInfo._fields_ = [
+    ("path", ct.c_char_p),
+    ("vendor_id", ct.c_ushort),
+    ("product_id", ct.c_ushort),
+    ("serial_number", ct.c_wchar_p),
+    ("release_number", ct.c_ushort),
+    ("manufacturer_string", ct.c_wchar_p),
+    ("product_string", ct.c_wchar_p),
+    ("usage_page", ct.c_ushort),
+    ("usage", ct.c_ushort),
+    ("interface_number", ct.c_int),
+    ("next", ct.POINTER(DeviceInfo)),
+]
+
+
 def set_hidapi_types(hidapi):
 
     hidapi.hid_init.argtypes = []
@@ -10,8 +29,8 @@ def set_hidapi_types(hidapi):
     hidapi.hid_exit.argtypes = []
     hidapi.hid_exit.restype = ct.c_int
     hidapi.hid_enumerate.argtypes = [ct.c_ushort, ct.c_ushort]
-    # hidapi.hid_enumerate.restype = ct.POINTER(DeviceInfo)
-    # hidapi.hid_free_enumeration.argtypes = [ct.POINTER(DeviceInfo)]
+    hidapi.hid_enumerate.restype = ct.POINTER(DeviceInfo)
+    hidapi.hid_free_enumeration.argtypes = [ct.POINTER(DeviceInfo)]
     hidapi.hid_free_enumeration.restype = None
     hidapi.hid_open.argtypes = [ct.c_ushort, ct.c_ushort, ct.c_wchar_p]
     hidapi.hid_open.restype = ct.c_void_p
@@ -36,7 +55,7 @@ def set_hidapi_types(hidapi):
     hidapi.hid_get_product_string.argtypes = [ct.c_void_p, ct.c_wchar_p, ct.c_size_t]
     hidapi.hid_get_product_string.restype = ct.c_int
     hidapi.hid_get_serial_number_string.argtypes = [ct.c_void_p, ct.c_wchar_p, ct.c_size_t]
-    hidapi.hid_get_serial_number_string = ct.c_int
+    hidapi.hid_get_serial_number_string.restype = ct.c_int
     hidapi.hid_get_indexed_string.argtypes = [ct.c_void_p, ct.c_int, ct.c_wchar_p, ct.c_size_t]
     hidapi.hid_get_indexed_string.restype = ct.c_int
     hidapi.hid_error.argtypes = [ct.c_void_p]
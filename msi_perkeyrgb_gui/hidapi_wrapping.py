@@ -1,11 +1,24 @@
-from time import sleep
+from time import monotonic, sleep
 from os.path import exists
-from os import popen
 import ctypes as ct
-import re
+import os
+from .hid_discovery import enumerate_hidapi, find_hid_devices, select_hid_device
 from .hidapi_types import set_hidapi_types
+from .metrics import get_metrics, report_type
+from .paths import cache_path
 
 DELAY = 0.01
+REPORT_LATENCY = 0.002  # seconds a report takes to send, until measured
+LATENCY_SMOOTHING = 0.1  # weight of the last report in the average latency
+HIDAPI_LIBRARY_NAMES = ["libhidapi-hidraw.so.0", "libhidapi-hidraw.so"]
+HIDAPI_PATH_CACHE_FILE = "hidapi_path"
+
+# HID backends, "sim" is a simulated keyboard for running without the hardware
+BACKENDS = ["hidapi", "sim"]
+DEFAULT_BACKEND = "hidapi"
+BACKEND_ENV = "MSI_PERKEYRGB_BACKEND"
+
+_hidapi = None
 
 
 class HIDLibraryError(Exception):
@@ -24,50 +37,254 @@ class HIDSendError(Exception):
     pass
 
 
-class HID_Keyboard:
+class ReportPacer:
+    """Keeps a minimum gap between two consecutive reports.
+
+    The RGB controller derps if commands are sent too fast, but there is no
+    need to sleep after a report if the caller was idle long enough anyway.
+    The time reports take to send, between wait() and mark(), is averaged in
+    latency, starting from REPORT_LATENCY.
+    """
+
+    def __init__(self, min_gap=DELAY):
+        self.min_gap = min_gap
+        self.latency = REPORT_LATENCY
+        self._last_write = None
+        self._send_start = None
+
+    def wait(self):
+        """Sleep until the next report can be sent, returns the time slept"""
+        slept = 0.0
+        if self._last_write is not None:
+            remaining = self._last_write + self.min_gap - monotonic()
+            if remaining > 0:
+                sleep(remaining)
+                slept = remaining
+        self._send_start = monotonic()
+        return slept
+
+    def mark(self):
+        self._last_write = monotonic()
+        if self._send_start is not None:
+            latency = self._last_write - self._send_start
+            self.latency += (latency - self.latency) * LATENCY_SMOOTHING
+            self._send_start = None
+
+
+def _loaded_library_path(name_prefix):
+    # Resolving the file the dynamic loader picked, without asking ldconfig
+    try:
+        with open("/proc/self/maps") as f:
+            for line in f:
+                path = line.rstrip("\n").partition("/")[2]
+                if path and os.path.basename(path).startswith(name_prefix):
+                    return "/" + path
+    except OSError:
+        pass
+
+
+def _load_cached_library():
+    try:
+        with open(cache_path(HIDAPI_PATH_CACHE_FILE)) as f:
+            lib_path = f.read().strip()
+    except OSError:
+        return None
 
-    def __init__(self, usb_id):
+    if exists(lib_path):
+        try:
+            return ct.cdll.LoadLibrary(lib_path)
+        except OSError:
+            pass
 
-        # Locating HIDAPI library
-        s = popen("ldconfig -p").read()
-        path_matches = re.findall("/.*libhidapi-hidraw\\.so.+", s)
-        if len(path_matches) == 0:
+
+def _store_cached_library(lib_path):
+    try:
+        path = cache_path(HIDAPI_PATH_CACHE_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(lib_path)
+    except OSError:
+        pass
+
+
+def load_hidapi():
+    """Load libhidapi-hidraw once per process.
+
+    The path resolved on a previous run is tried first, then the dynamic
+    loader's own search by soname. ctypes.util.find_library, which runs
+    ldconfig, is only used as a last resort.
+    """
+    global _hidapi
+    if _hidapi is not None:
+        return _hidapi
+
+    hidapi = _load_cached_library()
+
+    if hidapi is None:
+        for name in HIDAPI_LIBRARY_NAMES:
+            try:
+                hidapi = ct.cdll.LoadLibrary(name)
+            except OSError:
+                continue
+            lib_path = _loaded_library_path("libhidapi-hidraw.so")
+            if lib_path:
+                _store_cached_library(lib_path)
+            break
+
+    if hidapi is None:
+        import ctypes.util
+
+        lib_path = ctypes.util.find_library("hidapi-hidraw")
+        if lib_path is None:
             raise HIDLibraryError("Cannot locate the hidapi library")
+        try:
+            hidapi = ct.cdll.LoadLibrary(lib_path)
+        except OSError as e:
+            raise HIDLibraryError(
+                "Cannot load HIDAPI library %s : %s" % (lib_path, str(e))
+            ) from e
+
+    set_hidapi_types(hidapi)
+    _hidapi = hidapi
+    return _hidapi
+
+
+def _c_data(data):
+    # ctypes arrays, such as KeyColorsPacket.c_buffer, are passed without a copy
+    if isinstance(data, ct.Array):
+        return data
+    return bytes(data)
 
-        lib_path = path_matches[0]
 
-        if not exists(lib_path):
-            raise HIDLibraryError("ldconfig reports HIDAPI library at %s but file does not exists." % lib_path)
+class HidapiBackend:
+    """Sends reports to the keyboard through libhidapi-hidraw.
+
+    HID backends only send reports and return the number of bytes sent (-1
+    on error), report pacing and error checking are done by HID_Keyboard.
+    device selects one keyboard among those with usb_id, by hidraw path or
+    serial number, the first one being opened otherwise. path is the hidraw
+    node opened, None when unknown.
+    """
+
+    # Count of the reports the keyboard ignored, which the controller does
+    # not tell : None means unknown, unlike the simulated keyboard
+    dropped = None
+
+    def __init__(self, usb_id, device=None):
 
         # Loading HIDAPI library
-        self._hidapi = ct.cdll.LoadLibrary(lib_path)
-        set_hidapi_types(self._hidapi)
+        self._hidapi = load_hidapi()
 
         # Checking if the USB device corresponding to the keyboard exists
         vid, pid = usb_id
-        vid_str = hex(vid)[2:].zfill(4)
-        pid_str = hex(pid)[2:].zfill(4)
-        id_str = vid_str + ":" + pid_str
-        s = popen("lsusb").read()
-        if s.find(id_str) == -1:
+        devices = find_hid_devices(usb_id, self._hidapi)
+        if not devices:
             raise HIDNotFoundError
 
-        self._device = self._hidapi.hid_open(vid, pid, ct.c_wchar_p(0))
+        if device is None:
+            # The device hid_open would pick, with its path known for hotplug
+            # events. Only when hidapi does not list it, path stays unknown.
+            hidapi_devices = enumerate_hidapi(usb_id, self._hidapi)
+            if hidapi_devices:
+                self.path = hidapi_devices[0].path
+                self._device = self._hidapi.hid_open_path(self.path.encode())
+            else:
+                self.path = None
+                self._device = self._hidapi.hid_open(vid, pid, ct.c_wchar_p(0))
+        else:
+            hid_device = select_hid_device(devices, device)
+            if hid_device is None:
+                raise HIDNotFoundError
+            self.path = hid_device.path
+            self._device = self._hidapi.hid_open_path(self.path.encode())
 
         if self._device is None:
             raise HIDOpenError
 
     def send_feature_report(self, data):
-        ret = self._hidapi.hid_send_feature_report(self._device, bytes(data), len(data))
-        sleep(DELAY)  # The RGB controller derps if commands are sent too fast.
+        return self._hidapi.hid_send_feature_report(
+            self._device, _c_data(data), len(data)
+        )
+
+    def write(self, data):
+        return self._hidapi.hid_write(self._device, _c_data(data), len(data))
+
+    def close(self):
+        if self._device is not None:
+            self._hidapi.hid_close(self._device)
+            self._device = None
+
+
+def selected_backend(name=None):
+    """The HID backend called name, or the one selected by BACKEND_ENV"""
+    return name or os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND
+
+
+def open_backend(name, usb_id, device=None):
+    """Open the HID backend called name, or the one selected by BACKEND_ENV"""
+    name = selected_backend(name)
+    if name == "hidapi":
+        return HidapiBackend(usb_id, device)
+    if name == "sim":
+        from .hid_sim import SimulatedKeyboard
+
+        return SimulatedKeyboard.from_env()
+    raise ValueError("Unknown HID backend %s, available : %s" % (name, BACKENDS))
+
+
+class HID_Keyboard:
+
+    def __init__(self, usb_id, min_gap=DELAY, backend=None, device=None):
+
+        self.pacer = ReportPacer(min_gap)
+        # backend is the name of one of BACKENDS, or an already opened backend
+        if backend is None or isinstance(backend, str):
+            backend = open_backend(backend, usb_id, device)
+        self.backend = backend
+        self.metrics = get_metrics()
+
+    @property
+    def path(self):
+        return self.backend.path
+
+    @property
+    def dropped_reports(self):
+        """Reports the keyboard ignored so far, None if the backend cannot tell"""
+        return self.backend.dropped
+
+    def close(self):
+        self.backend.close()
+
+    def _send_measured(self, send, data):
+        # Same as the plain sends below, with timings recorded in the metrics
+        paced = self.pacer.wait()
+        start = monotonic()
+        ret = send(data)
+        self.pacer.mark()
+        ok = ret != -1 and ret == len(data)
+        self.metrics.observe_report(
+            report_type(data), len(data), monotonic() - start, paced, ok
+        )
+        return ret
+
+    def send_feature_report(self, data):
+        if self.metrics is not None:
+            ret = self._send_measured(self.backend.send_feature_report, data)
+        else:
+            self.pacer.wait()  # The RGB controller derps if commands are sent too fast.
+            ret = self.backend.send_feature_report(data)
+            self.pacer.mark()
 
         if ret == -1 or ret != len(data):
             raise HIDSendError("HIDAPI returned error upon sending feature report to keyboard.")
 
     def send_output_report(self, data):
-
-        ret = self._hidapi.hid_write(self._device, bytes(data), len(data))
-        sleep(DELAY)
+        if self.metrics is not None:
+            ret = self._send_measured(self.backend.write, data)
+        else:
+            self.pacer.wait()
+            ret = self.backend.write(data)
+            self.pacer.mark()
 
         if ret == -1 or ret != len(data):
             raise HIDSendError("HIDAPI returned error upon sending output report to keyboard.")
@@ -0,0 +1,121 @@
+import logging
+import socket
+import threading
+
+from .hid_discovery import find_hid_devices
+
+log = logging.getLogger(__name__)
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_UEVENT_GROUP = 1
+UEVENT_BUFFER_SIZE = 16384
+POLL_INTERVAL = 1.0  # seconds, also the delay for stop() to take effect
+REOPEN_TIMEOUT = 2.0  # seconds, for udev to set the permissions of a new node
+
+
+def parse_uevent(data):
+    """(action, {key: value}) of a kernel uevent message"""
+    header, *fields = data.split(b"\0")
+    action = header.partition(b"@")[0].decode(errors="replace")
+    env = {}
+    for field in fields:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            env[key.decode(errors="replace")] = value.decode(errors="replace")
+    return action, env
+
+
+def _open_uevent_socket():
+    sock = socket.socket(
+        socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+    )
+    try:
+        sock.bind((0, KERNEL_UEVENT_GROUP))
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(POLL_INTERVAL)
+    return sock
+
+
+class HotplugMonitor:
+    """Watches the hidraw nodes of the keyboards with usb_id, from a daemon thread.
+
+    on_removed(paths) is called when keyboards go away, and on_added(paths)
+    when they come back, both on the monitor thread with the set of hidraw
+    paths concerned. A keyboard re-enumerated under another node, as after a
+    suspend/resume, is seen as removed then added. Events come from the
+    kernel uevent netlink socket. Where it cannot be opened, the devices are
+    polled every POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, usb_id, on_added, on_removed=None):
+        self.usb_id = usb_id
+        self._on_added = on_added
+        self._on_removed = on_removed
+        self._paths = self._scan()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="msi-hotplug-monitor", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _scan(self):
+        return {device.path for device in find_hid_devices(self.usb_id)}
+
+    def _update(self, removed_path=None):
+        paths = self._scan()
+        # The sysfs entry of a node being removed can outlive the event
+        paths.discard(removed_path)
+        old_paths, self._paths = self._paths, paths
+
+        removed = old_paths - paths
+        added = paths - old_paths
+        if removed:
+            log.info("Keyboard disconnected from %s", ", ".join(sorted(removed)))
+            if self._on_removed is not None:
+                self._on_removed(removed)
+        if added:
+            log.info("Keyboard connected at %s", ", ".join(sorted(added)))
+            self._on_added(added)
+
+    def _run(self):
+        try:
+            sock = _open_uevent_socket()
+        except OSError as e:
+            log.info("Cannot listen to kernel uevents (%s), polling devices", e)
+            while not self._stop.wait(POLL_INTERVAL):
+                self._update()
+            return
+
+        with sock:
+            while not self._stop.is_set():
+                try:
+                    data = sock.recv(UEVENT_BUFFER_SIZE)
+                except socket.timeout:
+                    continue
+                except OSError as e:  # Events lost to a full buffer
+                    log.debug("Uevent socket error : %s", e)
+                    self._update()
+                    continue
+
+                action, env = parse_uevent(data)
+                if env.get("SUBSYSTEM") != "hidraw" or "DEVNAME" not in env:
+                    continue
+                if action == "remove":
+                    self._update("/dev/" + env["DEVNAME"])
+                elif action == "add":
+                    self._update()
@@ -0,0 +1,42 @@
+import json
+import os
+import socket
+
+SOCKET_NAME = "msi-perkeyrgb-gui.sock"
+CLIENT_TIMEOUT = 5
+
+
+class DaemonError(Exception):
+    pass
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    return os.path.join("/tmp", "%d-%s" % (os.getuid(), SOCKET_NAME))
+
+
+def send_command(request, socket_path=None, timeout=CLIENT_TIMEOUT):
+    """Send one JSON-lines request to a running daemon and return its reply.
+
+    Returns None if no daemon is listening on the socket.
+    """
+    socket_path = socket_path or default_socket_path()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+        line = f.readline()
+
+    if not line:
+        raise DaemonError("Daemon closed the connection without replying")
+    return json.loads(line)
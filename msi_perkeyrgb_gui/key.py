@@ -1,18 +1,49 @@
+import json
 from typing import Tuple
 
-from pydantic import BaseModel, validator
-
 from .parsing import parse_color
 
+DEFAULT_COLOR = "000000"
+
+
+class Key:
+    """A key of the GUI keyboard image.
+
+    Values are checked and converted when the key is created, from a bindings
+    file or a click. Assignments afterwards, like key.color on every color
+    picker event, are plain attribute writes.
+    """
+
+    __slots__ = ("box", "keycode", "name", "color")
 
-class Key(BaseModel):
-    box: Tuple[
-        Tuple[int, int],
-        Tuple[int, int],
-    ]
+    box: Tuple[Tuple[int, int], Tuple[int, int]]
     keycode: int
     name: str
-    color: str = "000000"
+    color: str
+
+    def __init__(self, box, keycode, name, color=DEFAULT_COLOR):
+        try:
+            (x0, y0), (x1, y1) = box
+            self.box = ((int(x0), int(y0)), (int(x1), int(y1)))
+            self.keycode = int(keycode)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid key %r : %s" % (name, e)) from e
+        self.name = str(name)
+        self.color = DEFAULT_COLOR if color == DEFAULT_COLOR else parse_color(color)
+
+    def dict(self):
+        return {
+            "box": self.box,
+            "keycode": self.keycode,
+            "name": self.name,
+            "color": self.color,
+        }
+
+    def json(self, exclude_defaults=False):
+        data = self.dict()
+        if exclude_defaults and self.color == DEFAULT_COLOR:
+            del data["color"]
+        return json.dumps(data)
 
     def __str__(self):
         return self.json(exclude_defaults=True)
@@ -32,7 +63,3 @@ class Key(BaseModel):
             if self.box[0][1] < y < self.box[1][1]:
                 return True
         return False
-
-    @validator("color", pre=True)
-    def v_color(cls, v) -> str:
-        return parse_color(v)
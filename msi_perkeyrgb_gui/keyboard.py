@@ -36,11 +36,31 @@ BULK_KEYCODES = {
 }
 
 
+# Side of the cells of the spatial index, in image pixels (about one key)
+GRID_CELL_SIZE = 48
+
+
 class Keyboard:
     keys: List[Key]
 
     def __init__(self, keys: List[Key]):
         self.keys = list(keys)
+        self._keys_by_keycode = {key.keycode: key for key in self.keys}
+
+        # Uniform grid over the key boxes : {(column, row): [keys overlapping the cell]}
+        self._grid = {}
+        for key in self.keys:
+            (x0, y0), (x1, y1) = key.box
+            for cell in self._cells(x0, y0, x1, y1):
+                self._grid.setdefault(cell, []).append(key)
+
+    @staticmethod
+    def _cells(x0, y0, x1, y1):
+        x0, x1 = sorted((int(x0) // GRID_CELL_SIZE, int(x1) // GRID_CELL_SIZE))
+        y0, y1 = sorted((int(y0) // GRID_CELL_SIZE, int(y1) // GRID_CELL_SIZE))
+        for column in range(x0, x1 + 1):
+            for row in range(y0, y1 + 1):
+                yield column, row
 
     @classmethod
     def load_keys(cls, filename: str):
@@ -133,16 +153,30 @@ class Keyboard:
             f.writelines([i + "\n" for i in lines])
 
     def get_xy(self, x: int, y: int) -> Optional[Key]:
-        for key in self:
+        cell = (int(x) // GRID_CELL_SIZE, int(y) // GRID_CELL_SIZE)
+        for key in self._grid.get(cell, ()):
             if key.clicked(x, y):
                 return key
         log.debug(f"Unknown key position: (%i,%i)", x, y)
 
+    def get_rect(self, x0: int, y0: int, x1: int, y1: int) -> List[Key]:
+        """Keys overlapping the rectangle between (x0, y0) and (x1, y1)"""
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+
+        keys = {}
+        for cell in self._cells(x0, y0, x1, y1):
+            for key in self._grid.get(cell, ()):
+                (kx0, ky0), (kx1, ky1) = key.box
+                if kx0 < x1 and x0 < kx1 and ky0 < y1 and y0 < ky1:
+                    keys[key.keycode] = key
+        return sorted(keys.values(), key=lambda k: k.keycode)
+
     def get_keycode(self, keycode: int) -> Optional[Key]:
-        for i in self:
-            if i.keycode == keycode:
-                return i
-        log.warning(f"Unknown keycode: {keycode}")
+        key = self._keys_by_keycode.get(keycode)
+        if key is None:
+            log.warning(f"Unknown keycode: {keycode}")
+        return key
 
     def __iter__(self):
         for i in self.keys:
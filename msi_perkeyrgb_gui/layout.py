@@ -0,0 +1,61 @@
+from collections import namedtuple
+
+from .protocol_data.keycodes import REGION_KEYCODES
+from .protocol_data.msi_keymaps import AVAILABLE_MSI_KEYMAPS
+from .protocol_data.presets_index import PRESETS_FILES
+
+# Position of a key in the protocol : region packet, slot in the region, MSI keycode
+KeySlot = namedtuple("KeySlot", ["region", "slot", "keycode"])
+
+MODEL_KEYMAPS = {
+    model: msi_keymap
+    for msi_models, msi_keymap in AVAILABLE_MSI_KEYMAPS
+    for model in msi_models
+}
+MODEL_PRESETS_FILES = {
+    model: filename for msi_models, filename in PRESETS_FILES for model in msi_models
+}
+
+# MSI keycode -> KeySlot, the zero padding entries of REGION_KEYCODES are left out
+MSI_KEY_SLOTS = {}
+for _region, _keycodes in REGION_KEYCODES.items():
+    for _slot, _keycode in enumerate(k for k in _keycodes if isinstance(k, int)):
+        MSI_KEY_SLOTS[_keycode] = KeySlot(_region, _slot, _keycode)
+
+
+class ModelLayout:
+    """Lookup tables of a keymap, built once and shared by every keyboard using it.
+
+    linux_slots is indexed directly by Linux keycode, and holds the KeySlot of
+    the key or None for keycodes the model does not have.
+    """
+
+    def __init__(self, msi_keymap):
+        self.msi_keymap = msi_keymap
+        self.slots = list(MSI_KEY_SLOTS.values())
+        self.region_slots = {region: [] for region in REGION_KEYCODES}
+        for key_slot in self.slots:
+            self.region_slots[key_slot.region].append(key_slot)
+
+        self.linux_slots = [None] * (max(msi_keymap, default=-1) + 1)
+        for linux_keycode, msi_keycode in msi_keymap.items():
+            self.linux_slots[linux_keycode] = MSI_KEY_SLOTS.get(msi_keycode)
+
+    def get_slot(self, linux_keycode):
+        try:
+            key_slot = self.linux_slots[linux_keycode]
+        except IndexError:
+            key_slot = None
+        if key_slot is None:
+            raise KeyError(linux_keycode)
+        return key_slot
+
+
+_layouts = {}
+
+
+def get_keymap_layout(msi_keymap):
+    layout = _layouts.get(id(msi_keymap))
+    if layout is None or layout.msi_keymap is not msi_keymap:
+        layout = _layouts[id(msi_keymap)] = ModelLayout(msi_keymap)
+    return layout
@@ -1,28 +1,45 @@
 #!/usr/bin/env python
 
 import argparse
+import atexit
 import logging
 import os
+import signal
 import sys
 
-import gi
-
-gi.require_version("Gtk", "3.0")
-gi.require_version("Gdk", "3.0")
-
-from .config import load_steady, ConfigError
-from .gui_handlers import SetupHandler, ConfigHandler
+# GTK, the GUI handlers and the daemon are only imported by the modes
+# using them, to keep headless commands fast to start.
+from . import __version__
+from .config import (
+    load_steady,
+    parse_config,
+    parse_config_color,
+    read_config_frames,
+    ConfigError,
+    ConfigParseError,
+)
+from .hid_discovery import describe_permissions, find_hid_devices
+from .hidapi_wrapping import BACKEND_ENV, BACKENDS, DEFAULT_BACKEND, selected_backend
+from .hotplug import HotplugMonitor
+from .ipc import DaemonError, send_command
 from .msikeyboard import MSIKeyboard, UnknownModelError
+from .metrics import enable_metrics, start_textfile_writer
+from .msiprotocol import EFFECTS, MAX_EFFECT_DURATION
+from .pacing import (
+    CalibrationError,
+    calibrate_pacing,
+    get_model_min_gap,
+    store_cached_gap,
+)
 from .parsing import (
+    ColorParseError,
     parse_usb_id,
     parse_preset,
     UnknownIdError,
     UnknownPresetError,
 )
+from .writer import KeyboardGroup
 
-from gi.repository import Gtk
-
-__version__ = "3.0"
 DEFAULT_ID = "1038:1122"
 DEFAULT_MODEL = "GP75"  # Default laptop model if nothing specified
 
@@ -31,7 +48,17 @@ logging.getLogger().setLevel(logging.INFO)
 log = logging.getLogger(__name__)
 
 
-def run_gui(model, colors_filename, usb_id, setup=False):
+def run_gui(
+    model, colors_filename, usb_id, setup=False, live_preview=True, device=None
+):
+    import gi
+
+    gi.require_version("Gtk", "3.0")
+    gi.require_version("Gdk", "3.0")
+
+    from gi.repository import Gtk
+    from .gui_handlers import SetupHandler, ConfigHandler
+
     builder = Gtk.Builder()
 
     builder.add_from_file(os.path.join(os.path.dirname(__file__), "ui.glade"))
@@ -47,6 +74,8 @@ def run_gui(model, colors_filename, usb_id, setup=False):
             color_selector,
             colors_filename,
             usb_id,
+            live_preview,
+            device,
         )
     builder.connect_signals(h)
 
@@ -57,6 +86,93 @@ def run_gui(model, colors_filename, usb_id, setup=False):
     Gtk.main()
 
 
+def confirm_color(name):
+    answer = input("Is every key lit in %s ? [y/N] " % name)
+    return answer.strip().lower() in ("y", "yes")
+
+
+def forward_to_daemon(args, msi_model, usb_id):
+    """Hand the requested command over to a running daemon.
+
+    Returns False if there is no daemon able to take it, in which case the
+    command has to be applied by this process.
+    """
+    if args.disable:
+        request = {"cmd": "disable"}
+    elif args.preset:
+        request = {"cmd": "preset", "preset": args.preset}
+    else:
+        request = {"cmd": "steady", "color": args.steady}
+    request["model"] = msi_model
+    request["usb_id"] = list(usb_id)
+
+    try:
+        reply = send_command(request, args.socket)
+    except (OSError, ValueError, DaemonError) as e:
+        log.warning("Daemon did not answer, applying directly: %s", e)
+        return False
+
+    if reply is None or reply.get("mismatch"):
+        return False
+    if not reply["ok"]:
+        print(reply["error"])
+        sys.exit(1)
+    return True
+
+
+def apply_to_keyboards(keyboards, update, synchronized=False):
+    """Run update(kb) then refresh, on the keyboards in parallel if there are several.
+
+    False if some of them did not apply it.
+    """
+    if len(keyboards) == 1:
+        kb = keyboards[0]
+        update(kb)
+        kb.refresh()
+        return True
+
+    with KeyboardGroup(keyboards, synchronized) as group:
+        group.call(update)
+    if group.unapplied:
+        log.error(
+            "Command not applied to %d of %d keyboards",
+            group.unapplied,
+            len(keyboards),
+        )
+    return not group.unapplied
+
+
+def run_stream(keyboards, msi_keymap, stream, usb_id=None, synchronized=False):
+    """Apply each frame of a config stream as soon as it is received.
+
+    Keys missing from a frame keep their color. A frame that cannot be
+    parsed is reported and skipped, the following ones are still applied.
+    Frames arriving faster than the keyboards accept them are merged by
+    their writer threads, so the keyboards never lag behind the stream.
+    If the keyboards usb_id is given, they are reopened with their last
+    state whenever they reappear after an unplug or a suspend.
+    """
+    with KeyboardGroup(keyboards, synchronized) as writer:
+        if usb_id is not None:
+            HotplugMonitor(usb_id, writer.reconnect, writer.disconnect).start()
+        for i, frame in enumerate(read_config_frames(stream)):
+            try:
+                colors_map, warnings = parse_config(
+                    frame.splitlines(True), msi_keymap
+                )
+            except (ConfigParseError, ColorParseError) as e:
+                log.warning("Frame %d skipped : %s", i + 1, e)
+                continue
+            for w in warnings:
+                log.warning("Frame %d : %s", i + 1, w)
+            if not writer.submit(colors_map):
+                break
+
+    log.info("Stream ended : %s", writer)
+    if writer.error is not None:
+        raise writer.error
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Tool to control per-key RGB keyboard backlighting on MSI laptops. https://github.com/Askannz/msi-perkeyrgb"
@@ -70,7 +186,8 @@ def main():
         action="store",
         metavar="FILEPATH",
         help='Loads the configuration file located at FILEPATH. Refer to the README for syntax. If set to "-", '
-        "the configuration file is read from the standard input (stdin) instead.",
+        "configurations are read continuously from the standard input (stdin), "
+        "as frames separated by blank lines or NUL characters.",
         default="config.msic",
     )
     parser.add_argument(
@@ -84,6 +201,34 @@ def main():
         "You should not have to use this unless opening the keyboard fails with the default value. "
         "IDs are in hexadecimal format (example :  1038:1122)",
     )
+    parser.add_argument(
+        "--backend",
+        action="store",
+        choices=BACKENDS,
+        help="HID backend used to talk to the keyboard. "
+        '"sim" simulates a keyboard, to try this program without the hardware. '
+        "Defaults to $%s, or %s." % (BACKEND_ENV, DEFAULT_BACKEND),
+    )
+    parser.add_argument(
+        "--device",
+        action="append",
+        metavar="PATH_OR_SERIAL",
+        help="Keyboard to drive among those with the vendor/product ID, "
+        "by hidraw path (/dev/hidrawN) or serial number (see --list-devices). "
+        "Repeat it to drive several keyboards in parallel.",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="With several --device, switch every keyboard to each new frame "
+        "at the same time.",
+    )
+    parser.add_argument(
+        "--list-devices",
+        action="store_true",
+        help="List HID devices matching the keyboard vendor/product ID, "
+        "with their hidraw paths and permissions.",
+    )
     parser.add_argument(
         "--list-presets",
         action="store_true",
@@ -102,7 +247,67 @@ def main():
     parser.add_argument(
         "--list-models", action="store_true", help="List available laptop models."
     )
+    parser.add_argument(
+        "-e",
+        "--effect",
+        action="store",
+        choices=sorted(EFFECTS),
+        help="Upload an effect that the keyboard runs on its own on every key.",
+    )
+    parser.add_argument(
+        "--effect-colors",
+        action="store",
+        metavar="COLORS",
+        default="red,green,blue",
+        help="Comma separated colors used by --effect (breathing only uses the first one).",
+    )
+    parser.add_argument(
+        "--effect-period",
+        action="store",
+        metavar="MS",
+        type=int,
+        default=3000,
+        help="Duration of one cycle of --effect, in milliseconds (at most %d)."
+        % MAX_EFFECT_DURATION,
+    )
+    parser.add_argument(
+        "--calibrate-pacing",
+        action="store_true",
+        help="Find the smallest safe delay between two reports for the given laptop model, "
+        "and store it for later runs.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep the keyboard open and apply commands sent by other invocations "
+        "of this program (--steady, --preset, --disable and the GUI).",
+    )
+    parser.add_argument(
+        "--socket",
+        action="store",
+        metavar="PATH",
+        help="Unix socket used to talk to the daemon. "
+        "Defaults to $XDG_RUNTIME_DIR/msi-perkeyrgb-gui.sock.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print keyboard I/O statistics (report latencies, errors, frames) on exit.",
+    )
+    parser.add_argument(
+        "--stats-file",
+        action="store",
+        metavar="PATH",
+        help="Write keyboard I/O metrics to PATH in the Prometheus text format, "
+        "for the node exporter textfile collector. Updated every few seconds and on exit.",
+    )
     parser.add_argument("--setup", action="store_true", help="Open app in setup mode.")
+    parser.add_argument(
+        "--no-live-preview",
+        action="store_true",
+        help="Only update the keyboard when the configuration is saved from the GUI, "
+        "instead of showing colors on the keyboard as they are picked.",
+    )
     parser.add_argument(
         "-s",
         "--steady",
@@ -115,7 +320,7 @@ def main():
 
     if args.version:
         print("Version: %s" % __version__)
-        sys.exit(1)
+        sys.exit(0)
 
     if args.list_models:
         print("Available laptop models are :")
@@ -127,7 +332,7 @@ def main():
             "(with a keyboard layout as similar as possible). "
             "This tool will only work with per-key RGB models."
         )
-        sys.exit(1)
+        sys.exit(0)
 
     # Parse laptop model
     if not args.model:
@@ -150,31 +355,159 @@ def main():
             print("Unknown vendor/product ID : %s" % args.id)
             sys.exit(1)
 
-    # Loading presets
+    # Metrics are only collected when asked for
+    if args.stats or args.stats_file:
+        metrics = enable_metrics()
+        if args.stats:
+            atexit.register(lambda: print(metrics, file=sys.stderr))
+        if args.stats_file:
+            start_textfile_writer(metrics, args.stats_file)
+            atexit.register(metrics.write_textfile, args.stats_file)
+
+    # Set in the environment, so that every keyboard this process opens uses it
+    if args.backend:
+        os.environ[BACKEND_ENV] = args.backend
+
+    if args.list_devices:
+        devices = find_hid_devices(usb_id)
+        id_str = "%04x:%04x" % usb_id
+        if not devices:
+            print("No HID device with ID %s found." % id_str)
+        else:
+            print("HID devices with ID %s:" % id_str)
+            for device in devices:
+                print(
+                    "\t- %s : %s%s"
+                    % (
+                        device.path,
+                        describe_permissions(device.path),
+                        ", serial %s" % device.serial if device.serial else "",
+                    )
+                )
+        sys.exit(0)
+
+    # Forwarding the command to a running daemon, if any. It drives the
+    # first keyboard found, so commands for given devices are applied here,
+    # and so are those for the simulated keyboard.
+    if (
+        not args.daemon
+        and not args.device
+        and selected_backend() == "hidapi"
+        and (args.disable or args.preset or args.steady)
+    ):
+        if forward_to_daemon(args, msi_model, usb_id):
+            sys.exit(0)
+
+    # Presets are only read from disk if --preset or --list-presets needs them
     msi_presets = MSIKeyboard.get_model_presets(msi_model)
 
     if args.list_presets:
-        if msi_presets == {}:
+        if not msi_presets:
             print("No presets available for %s." % msi_model)
         else:
             print("Available presets for %s:" % msi_model)
             for preset in msi_presets.keys():
                 print("\t- %s" % preset)
-        sys.exit(1)
+        sys.exit(0)
 
     # Loading keymap
     msi_keymap = MSIKeyboard.get_model_keymap(msi_model)
 
-    # Loading keyboard
-    kb = MSIKeyboard.get(usb_id, msi_keymap, msi_presets)
-    if not kb:
+    # Several keyboards are only driven by the one-shot commands and the
+    # config stream
+    devices = args.device or [None]
+    one_shot = args.disable or args.preset or args.effect or args.steady
+    gui = not (args.calibrate_pacing or args.daemon or one_shot or args.config == "-")
+    if len(devices) > 1 and (args.calibrate_pacing or args.daemon or gui):
+        print("Several --device are only supported with -d, -p, -e, -s and -c -.")
         sys.exit(1)
 
+    # If user has not requested anything. The GUI opens the keyboard itself
+    # when it first sends something, and setup mode never does.
+    if gui:
+        if not os.path.isfile(args.config):
+            with open(args.config, "w") as i:
+                with open(
+                    os.path.join(os.path.dirname(__file__), "configs", "default.msic")
+                ) as o:
+                    print(
+                        f"Config file {args.config} not found, new created from default"
+                    )
+                    i.write(o.read())
+        run_gui(
+            msi_model,
+            args.config,
+            usb_id,
+            args.setup,
+            not args.no_live_preview,
+            devices[0],
+        )
+        return
+
+    # Loading keyboards, each one paced on its own
+    min_gap = get_model_min_gap(msi_model)
+    keyboards = []
+    for device in devices:
+        kb = MSIKeyboard.get(usb_id, msi_keymap, msi_presets, min_gap, device)
+        if not kb:
+            sys.exit(1)
+        keyboards.append(kb)
+    kb = keyboards[0]
+
+    # If user has requested pacing calibration
+    if args.calibrate_pacing:
+        # Without a count of the ignored reports, the user checks the colors
+        confirm = None
+        if kb.dropped_reports is None:
+            if not sys.stdin.isatty():
+                print(
+                    "Calibration asks you to check the keyboard colors, "
+                    "run it from a terminal."
+                )
+                sys.exit(1)
+            confirm = confirm_color
+        try:
+            gap = calibrate_pacing(kb, confirm=confirm)
+        except CalibrationError as e:
+            print("Cannot calibrate pacing : %s" % str(e))
+            sys.exit(1)
+
+        if gap is None:
+            print("The keyboard rejected every tested delay, nothing stored.")
+            sys.exit(1)
+        elif selected_backend() != "hidapi":
+            print(
+                "Safe delay for the simulated keyboard : %.1f ms, not stored."
+                % (gap * 1000)
+            )
+        else:
+            store_cached_gap(msi_model, gap)
+            print("Safe delay for %s : %.1f ms" % (msi_model, gap * 1000))
+        sys.exit(0)
+
+    # If user has requested to run as a daemon
+    if args.daemon:
+        from .daemon import LightingDaemon
+
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        daemon = LightingDaemon(
+            kb, msi_model, usb_id, msi_keymap, msi_presets, args.socket
+        )
+        try:
+            daemon.serve_forever()
+        except DaemonError as e:
+            print(str(e))
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     # If user has requested disabling
-    if args.disable:
-        kb.set_color_all([0, 0, 0])
-        kb.refresh()
-        sys.exit(1)
+    elif args.disable:
+        applied = apply_to_keyboards(
+            keyboards, lambda kb: kb.set_color_all([0, 0, 0]), args.sync
+        )
+        sys.exit(0 if applied else 1)
 
     # If user has requested a preset
     elif args.preset:
@@ -187,9 +520,29 @@ def main():
             )
             sys.exit(1)
 
-        kb.set_preset(preset)
-        kb.refresh()
-        sys.exit(1)
+        applied = apply_to_keyboards(
+            keyboards, lambda kb: kb.set_preset(preset), args.sync
+        )
+        sys.exit(0 if applied else 1)
+
+    # If user has requested an effect run by the keyboard itself
+    elif args.effect:
+        try:
+            colors = [parse_config_color(c) for c in args.effect_colors.split(",")]
+        except ColorParseError as e:
+            print("Error preparing effect : %s" % str(e))
+            sys.exit(1)
+        if not 1 <= args.effect_period <= MAX_EFFECT_DURATION:
+            print(
+                "Error preparing effect : the period must be between 1 and %d ms"
+                % MAX_EFFECT_DURATION
+            )
+            sys.exit(1)
+        effect = EFFECTS[args.effect](colors, args.effect_period)
+        applied = apply_to_keyboards(
+            keyboards, lambda kb: kb.set_effect(effect, msi_keymap.keys()), args.sync
+        )
+        sys.exit(0 if applied else 1)
 
     # If user has requested to display a steady color
     elif args.steady:
@@ -198,22 +551,21 @@ def main():
         except ConfigError as e:
             print("Error preparing steady color : %s" % str(e))
             sys.exit(1)
-        kb.set_colors(colors_map)
-        kb.refresh()
-        sys.exit(1)
+        applied = apply_to_keyboards(
+            keyboards, lambda kb: kb.set_colors(colors_map), args.sync
+        )
+        sys.exit(0 if applied else 1)
 
-    # If user has not requested anything
-    else:
-        if not os.path.isfile(args.config):
-            with open(args.config, "w") as i:
-                with open(
-                    os.path.join(os.path.dirname(__file__), "configs", "default.msic")
-                ) as o:
-                    print(
-                        f"Config file {args.config} not found, new created from default"
-                    )
-                    i.write(o.read())
-        run_gui(msi_model, args.config, usb_id, args.setup)
+    # If user is streaming configs through stdin
+    elif args.config == "-":
+        try:
+            run_stream(keyboards, msi_keymap, sys.stdin.buffer, usb_id, args.sync)
+        except ConfigError as e:
+            print("Error reading config stream : %s" % str(e))
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,248 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+
+log = logging.getLogger(__name__)
+
+# Report latency buckets, in seconds
+LATENCY_BUCKETS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5]
+REPORT_TYPES = {0x0e: "colors", 0x0b: "effect", 0x09: "refresh"}
+TEXTFILE_INTERVAL = 15  # seconds
+PREFIX = "msi_perkeyrgb_"
+
+_metrics = None
+
+
+def get_metrics():
+    """The process metrics, None unless enable_metrics was called"""
+    return _metrics
+
+
+def enable_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+def report_type(data):
+    first = data[0]
+    if isinstance(first, bytes):  # ctypes char arrays
+        first = first[0]
+    return REPORT_TYPES.get(first, "other")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, count of values below it), ...] ending with +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Counters of the keyboard I/O of this process.
+
+    Nothing is measured unless enable_metrics is called, HID_Keyboard and
+    the frame producers only check get_metrics() for None otherwise.
+    Counters are shared by the writer threads of every keyboard, so they
+    are only updated through observe_report and add, under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.report_latency = {}
+        self.reports = {}
+        self.report_bytes = 0
+        self.pacing_seconds = 0.0
+        self.errors = {}
+        self.frames_applied = 0
+        self.frames_merged = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self.reconnects = 0
+
+    def observe_report(self, kind, size, latency, paced, ok):
+        with self._lock:
+            histogram = self.report_latency.get(kind)
+            if histogram is None:
+                histogram = self.report_latency[kind] = Histogram()
+            histogram.observe(latency)
+            self.reports[kind] = self.reports.get(kind, 0) + 1
+            self.pacing_seconds += paced
+            if ok:
+                self.report_bytes += size
+            else:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def add(self, counter, value=1):
+        """Increment one of the frames_* or reconnects counters"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def snapshot(self):
+        """Metrics as a JSON serializable dict"""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            "reports": dict(self.reports),
+            "report_bytes": self.report_bytes,
+            "pacing_seconds": self.pacing_seconds,
+            "errors": dict(self.errors),
+            "frames_applied": self.frames_applied,
+            "frames_merged": self.frames_merged,
+            "frames_dropped": self.frames_dropped,
+            "frames_skipped": self.frames_skipped,
+            "reconnects": self.reconnects,
+            "report_latency": {
+                kind: {
+                    "count": h.count,
+                    "sum": h.sum,
+                    "buckets": [[b, c] for b, c in h.cumulative()[:-1]],
+                }
+                for kind, h in self.report_latency.items()
+            },
+        }
+
+    def __str__(self):
+        with self._lock:
+            return self._str()
+
+    def _str(self):
+        lines = [
+            "Reports : %d (%d bytes), %d errors, %.3f s spent pacing"
+            % (
+                sum(self.reports.values()),
+                self.report_bytes,
+                sum(self.errors.values()),
+                self.pacing_seconds,
+            ),
+            "Frames : %d applied, %d merged, %d dropped, %d skipped by animations"
+            % (
+                self.frames_applied,
+                self.frames_merged,
+                self.frames_dropped,
+                self.frames_skipped,
+            ),
+            "Reconnects : %d" % self.reconnects,
+        ]
+        for kind, h in sorted(self.report_latency.items()):
+            mean = h.sum / h.count if h.count else 0.0
+            lines.append(
+                "%s reports : %d, mean latency %.2f ms, %d errors"
+                % (kind, h.count, mean * 1000, self.errors.get(kind, 0))
+            )
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            return self._prometheus()
+
+    def _prometheus(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP %s%s %s" % (PREFIX, name, help_text))
+            lines.append("# TYPE %s%s %s" % (PREFIX, name, kind))
+            for suffix, labels, value in samples:
+                labels = ",".join('%s="%s"' % label for label in labels)
+                lines.append(
+                    "%s%s%s%s %s"
+                    % (PREFIX, name, suffix, "{%s}" % labels if labels else "", value)
+                )
+
+        latency = []
+        for kind, h in sorted(self.report_latency.items()):
+            for bound, count in h.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                latency.append(("_bucket", [("type", kind), ("le", le)], count))
+            latency.append(("_sum", [("type", kind)], repr(h.sum)))
+            latency.append(("_count", [("type", kind)], h.count))
+        metric(
+            "report_latency_seconds",
+            "histogram",
+            "Time taken by the HID backend to send a report.",
+            latency,
+        )
+        metric(
+            "reports_total",
+            "counter",
+            "Reports sent to the keyboard.",
+            [("", [("type", k)], v) for k, v in sorted(self.reports.items())],
+        )
+        metric(
+            "report_errors_total",
+            "counter",
+            "Reports the HID backend failed to send.",
+            [("", [("type", k)], v) for k, v in sorted(self.errors.items())],
+        )
+        metric(
+            "report_bytes_total",
+            "counter",
+            "Bytes sent to the keyboard.",
+            [("", [], self.report_bytes)],
+        )
+        metric(
+            "pacing_seconds_total",
+            "counter",
+            "Time spent waiting between reports.",
+            [("", [], repr(self.pacing_seconds))],
+        )
+        for name, value, help_text in (
+            ("frames_applied_total", self.frames_applied, "Frames sent."),
+            ("frames_merged_total", self.frames_merged, "Frames merged."),
+            (
+                "frames_dropped_total",
+                self.frames_dropped,
+                "Frames overridden in a writer queue before being sent.",
+            ),
+            (
+                "frames_skipped_total",
+                self.frames_skipped,
+                "Animation frames skipped to catch up with their deadlines.",
+            ),
+            ("reconnects_total", self.reconnects, "Keyboard reopened and replayed."),
+        ):
+            metric(name, "counter", help_text, [("", [], value)])
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write the metrics for the node exporter textfile collector"""
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Cannot write metrics to %s : %s", path, e)
+
+
+def start_textfile_writer(metrics, path, interval=TEXTFILE_INTERVAL):
+    """Rewrite the metrics textfile every interval seconds, from a daemon thread"""
+
+    def run():
+        while not stop.wait(interval):
+            metrics.write_textfile(path)
+
+    stop = threading.Event()
+    threading.Thread(target=run, name="msi-metrics-textfile", daemon=True).start()
+    return stop
@@ -1,14 +1,25 @@
-import json
-import os
 import random
+from time import monotonic, sleep
 
 from .hidapi_wrapping import (
+    DELAY,
     HID_Keyboard,
     HIDLibraryError,
     HIDNotFoundError,
     HIDOpenError,
+    HIDSendError,
 )
-from .msiprotocol import make_key_colors_packet, make_refresh_packet
+from .layout import MODEL_KEYMAPS, MODEL_PRESETS_FILES, get_keymap_layout
+from .metrics import get_metrics
+from .msiprotocol import (
+    KEY_COLORS_PACKET_LEN,
+    REGION_ID_OFFSET,
+    REGIONS_BY_ID_CODE,
+    KeyColorsPacket,
+    make_effect_packet,
+    make_refresh_packet,
+)
+from .presets import PresetStore
 from .protocol_data.keycodes import REGION_KEYCODES
 from .protocol_data.msi_keymaps import AVAILABLE_MSI_KEYMAPS
 from .protocol_data.presets_index import PRESETS_FILES
@@ -18,93 +29,279 @@ class UnknownModelError(Exception):
     pass
 
 
+REOPEN_RETRY_DELAY = 0.01  # seconds
+
+
 class MSIKeyboard:
+    """Per-key RGB controller of an MSI laptop.
+
+    The keyboard state is kept as the list of reports that produce it : the
+    last preset, the effects uploaded since, and the region packets. Should a
+    report fail to send, the keyboard is considered disconnected, updates
+    only change that state, and reopen() replays it on the device once it is
+    back (see hotplug.HotplugMonitor).
+    """
+
     presets_files = PRESETS_FILES
     available_msi_keymaps = AVAILABLE_MSI_KEYMAPS
     region_keycodes = REGION_KEYCODES
 
-    def __init__(self, usb_id, msi_keymap, msi_presets):
-        self._hid_keyboard = HID_Keyboard(usb_id)
+    def __init__(
+        self,
+        usb_id,
+        msi_keymap,
+        msi_presets,
+        min_gap=DELAY,
+        hid_keyboard=None,
+        device=None,
+    ):
+        # An already opened HID keyboard (or a stand-in for it) can be given instead.
+        # device is the hidraw path or serial number of the keyboard to open.
+        if hid_keyboard is None:
+            hid_keyboard = HID_Keyboard(usb_id, min_gap, device=device)
+        self._hid_keyboard = hid_keyboard
+        self._usb_id = usb_id
+        self._device = device
+        self.connected = True
         self._msi_keymap = msi_keymap
         self._msi_presets = msi_presets
+        self._layout = get_keymap_layout(msi_keymap)
+
+        # Region packets as last sent, used to skip unchanged keys and regions.
+        # They share one buffer so that set_colors_array can see them as an array.
+        self._frame = bytearray(len(REGION_KEYCODES) * KEY_COLORS_PACKET_LEN)
+        self._frame_fragments = None
+        self._packets = {}
+        for i, region in enumerate(REGION_KEYCODES):
+            offset = i * KEY_COLORS_PACKET_LEN
+            buffer = memoryview(self._frame)[offset : offset + KEY_COLORS_PACKET_LEN]
+            self._packets[region] = KeyColorsPacket(region, buffer)
+        self._refresh_pending = False
+        self._preset_reports = None
+        self._effect_packets = {}
+
+    @property
+    def pacer(self):
+        return self._hid_keyboard.pacer
+
+    @property
+    def dropped_reports(self):
+        return self._hid_keyboard.dropped_reports
+
+    @property
+    def device_path(self):
+        """The hidraw node of the keyboard, None when unknown"""
+        return self._hid_keyboard.path
 
     @classmethod
     def get_model_keymap(cls, msi_model):
-        for msi_models, msi_keymap in cls.available_msi_keymaps:
-            if msi_model in msi_models:
-                return msi_keymap
+        return MODEL_KEYMAPS.get(msi_model)
 
     @classmethod
     def get_model_presets(cls, msi_model):
-        for msi_models, filename in cls.presets_files:
-            if msi_model in msi_models:
-                presets_path = os.path.join(
-                    os.path.dirname(__file__), "protocol_data", "presets", filename
-                )
-                with open(presets_path) as f:
-                    msi_presets = json.load(f)
-
-                return msi_presets
+        filename = MODEL_PRESETS_FILES.get(msi_model)
+        if filename is None:
+            return {}
+        return PresetStore(filename)
 
     def set_color_all(self, color):
-        for region in self.region_keycodes.keys():
-            keycodes = self.region_keycodes[region]
-            n = len(keycodes)
-            colors_values = [color] * n
-            colors_map = dict(zip(keycodes, colors_values))
-
-            key_colors_packet = make_key_colors_packet(region, colors_map)
-            self._hid_keyboard.send_feature_report(key_colors_packet)
+        self._send_colors((key_slot, color) for key_slot in self._layout.slots)
 
     def set_random_color_all(self):
-        for region in self.region_keycodes.keys():
-            keycodes = self.region_keycodes[region]
-            n = len(keycodes)
-            colors_values = []
-            for _ in range(n):
-                r = random.randint(0, 255)
-                g = random.randint(0, 255)
-                b = random.randint(0, 255)
-                colors_values.append([r, g, b])
-            colors_map = dict(zip(keycodes, colors_values))
-
-            key_colors_packet = make_key_colors_packet(region, colors_map)
-            self._hid_keyboard.send_feature_report(key_colors_packet)
+        try:
+            from .framebuffer import random_frame
+        except ImportError:
+            pass
+        else:
+            self.set_colors_array(*random_frame(self._layout))
+            return
+
+        slots_colors = []
+        for key_slot in self._layout.slots:
+            r = random.randint(0, 255)
+            g = random.randint(0, 255)
+            b = random.randint(0, 255)
+            slots_colors.append((key_slot, [r, g, b]))
+
+        self._send_colors(slots_colors)
 
     def set_colors(self, linux_colors_map):
         # Translating from Linux keycodes to MSI's own encoding
-        linux_keycodes = linux_colors_map.keys()
-        colors = linux_colors_map.values()
-        msi_keycodes = [self._msi_keymap[k] for k in linux_keycodes]
-        msi_colors_map = dict(zip(msi_keycodes, colors))
-
-        # Sorting requested keycodes by keyboard region
-        maps_sorted_by_region = {}
-        for keycode in msi_colors_map.keys():
-            for region in self.region_keycodes.keys():
-                if keycode in self.region_keycodes[region]:
-                    if region not in maps_sorted_by_region.keys():
-                        maps_sorted_by_region[region] = {}
-                    maps_sorted_by_region[region][keycode] = msi_colors_map[keycode]
-
-        # Sending color commands by region
-        for region, region_colors_map in maps_sorted_by_region.items():
-            key_colors_packet = make_key_colors_packet(region, region_colors_map)
-            self._hid_keyboard.send_feature_report(key_colors_packet)
+        get_slot = self._layout.get_slot
+        self._send_colors((get_slot(k), c) for k, c in linux_colors_map.items())
+
+    def set_colors_array(self, linux_keycodes, colors):
+        """Vectorized set_colors : colors is a (n_keys, 3) uint8 array, requires NumPy"""
+        from .framebuffer import frame_fragments, scatter_colors
+
+        if self._frame_fragments is None:
+            self._frame_fragments = frame_fragments(self._frame, len(self._packets))
+
+        changed_regions = scatter_colors(
+            self._frame_fragments, self._layout, linux_keycodes, colors
+        )
+        self._send_regions(changed_regions)
+
+    def _send_colors(self, slots_colors):
+        # Writing keys in their region packet, unchanged ones are dropped.
+        # Changed regions are sent whole, see KeyColorsPacket.
+        packets = self._packets
+        changed_regions = set()
+        for key_slot, color in slots_colors:
+            packet = packets[key_slot.region]
+            if packet.set_key(key_slot.slot, key_slot.keycode, color):
+                changed_regions.add(key_slot.region)
+
+        self._send_regions(changed_regions)
+
+    def set_effect(self, effect, linux_keycodes, effect_id=0):
+        """Upload an effect and link keys to it, the controller then runs it alone"""
+        effect_packet = make_effect_packet(effect_id, effect)
+        self._effect_packets[effect_id] = effect_packet
+
+        get_slot = self._layout.get_slot
+        changed_regions = set()
+        for linux_keycode in linux_keycodes:
+            key_slot = get_slot(linux_keycode)
+            packet = self._packets[key_slot.region]
+            packet.set_key_effect(key_slot.slot, key_slot.keycode, effect_id)
+            changed_regions.add(key_slot.region)
+
+        # Sent once the whole state is updated, in case it has to be replayed
+        self._send_feature_report(effect_packet)
+        self._send_regions(changed_regions)
+        self._refresh_pending = True
+
+    def apply_packets(self, packets):
+        """Replay region packets as built by config_cache.compile_config.
+
+        Each packet replaces the region state, and regions already in that
+        exact state are not sent again.
+        """
+        changed_regions = set()
+        for data in packets:
+            region = REGIONS_BY_ID_CODE[data[REGION_ID_OFFSET]]
+            packet = self._packets[region]
+            if packet.view != data:
+                packet.view[:] = data
+                changed_regions.add(region)
+
+        self._send_regions(changed_regions)
+
+    def _send_regions(self, regions):
+        # Sending region packets in a stable order
+        for region, packet in self._packets.items():
+            if region not in regions:
+                continue
+            self._send_feature_report(packet.c_buffer)
+            self._refresh_pending = True
 
     def set_preset(self, preset):
         feature_reports_list = self._msi_presets[preset]
+        self.invalidate()
+        self._preset_reports = feature_reports_list
+        self._effect_packets = {}
         for data in feature_reports_list:
-            self._hid_keyboard.send_feature_report(bytearray.fromhex(data))
+            self._send_feature_report(data)
+        self._refresh_pending = True
+
+    def invalidate(self):
+        """Forget the keys sent so far, so that the next update resends every key"""
+        for packet in self._packets.values():
+            packet.clear()
 
     def refresh(self):
+        if not self._refresh_pending or not self.connected:
+            return
         refresh_packet = make_refresh_packet()
-        self._hid_keyboard.send_output_report(refresh_packet)
+        self._send_output_report(refresh_packet)
+        self._refresh_pending = False
+
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.add("frames_applied")
+
+    def _send_feature_report(self, data):
+        # Nothing is sent while disconnected, the state is replayed on reopen()
+        if not self.connected:
+            return
+        try:
+            self._hid_keyboard.send_feature_report(data)
+        except HIDSendError:
+            self._close()
+            raise
+
+    def _send_output_report(self, data):
+        try:
+            self._hid_keyboard.send_output_report(data)
+        except HIDSendError:
+            self._close()
+            raise
+
+    def _close(self):
+        # Closing twice is harmless, the handle is only closed once
+        self.connected = False
+        self._hid_keyboard.close()
+
+    def state_reports(self):
+        """The reports bringing a freshly opened keyboard to the current state"""
+        reports = list(self._preset_reports or [])
+        reports.extend(self._effect_packets.values())
+        for packet in self._packets.values():
+            if not packet.is_empty():
+                reports.append(packet.c_buffer)
+        return reports
+
+    def disconnect(self, removed_paths=None):
+        """Close the HID device, after it was unplugged.
+
+        With removed_paths, only if the keyboard node is among them, or unknown.
+        """
+        path = self.device_path
+        if removed_paths and path is not None and path not in removed_paths:
+            return
+        self._close()
+
+    def reopen(self, timeout=0):
+        """Open the keyboard again and replay its state, after it was unplugged or
+        the system resumed from suspend.
+
+        Opening is retried for up to timeout seconds while the device node
+        exists but cannot be opened, which happens until udev has set its
+        permissions. Raises HIDNotFoundError or HIDOpenError if the keyboard
+        is still not there.
+        """
+        self.disconnect()
+        pacer = self._hid_keyboard.pacer
+        deadline = monotonic() + timeout
+        while True:
+            try:
+                hid_keyboard = HID_Keyboard(
+                    self._usb_id, pacer.min_gap, device=self._device
+                )
+                break
+            except HIDOpenError:
+                if monotonic() >= deadline:
+                    raise
+                sleep(REOPEN_RETRY_DELAY)
+
+        hid_keyboard.pacer = pacer
+        self._hid_keyboard = hid_keyboard
+        self.connected = True
+
+        for data in self.state_reports():
+            self._send_feature_report(data)
+        self._refresh_pending = True
+        self.refresh()
+
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.add("reconnects")
 
     @classmethod
-    def get(cls, usb_id, msi_keymap, msi_presets):
+    def get(cls, usb_id, msi_keymap, msi_presets, min_gap=DELAY, device=None):
         try:
-            return MSIKeyboard(usb_id, msi_keymap, msi_presets)
+            return MSIKeyboard(usb_id, msi_keymap, msi_presets, min_gap, device=device)
         except HIDLibraryError as e:
             print(
                 "Cannot open HIDAPI library : %s. "
@@ -120,6 +317,8 @@ class MSIKeyboard:
                     "In that case you will also need to give yourself proper read/write permissions "
                     "to the corresponding /dev/hidraw* device."
                 )
+            elif device is not None:
+                print("No device %s with ID %s found." % (device, usb_id))
             else:
                 print("No USB device with ID %s found." % usb_id)
         except HIDOpenError:
@@ -135,9 +334,7 @@ class MSIKeyboard:
     @classmethod
     def parse_model(cls, model_arg):
         model_arg_nocase = model_arg.upper()
-        for msi_models, _ in cls.available_msi_keymaps:
-            for model in msi_models:
-                if model == model_arg_nocase:
-                    return model
+        if model_arg_nocase in MODEL_KEYMAPS:
+            return model_arg_nocase
 
         raise UnknownModelError(model_arg)
@@ -1,34 +1,310 @@
+import ctypes as ct
+from collections import namedtuple
+from itertools import product
+
 NB_KEYS = 42
 REGION_ID_CODES = {"alphanum": 0x2a, "enter": 0x0b, "modifiers": 0x18, "numpad": 0x24}
+REGIONS_BY_ID_CODE = {code: region for region, code in REGION_ID_CODES.items()}
+
+HEADER_LEN = 4
+REGION_ID_OFFSET = 2
+KEY_FRAGMENT_LEN = 12
+TRAILER = bytes([0x00] * 14 + [0x08, 0x39])
+KEY_COLORS_PACKET_LEN = HEADER_LEN + NB_KEYS * KEY_FRAGMENT_LEN + len(TRAILER)
+
+# Offsets inside a key fragment
+EFFECT_ID_OFFSET = 8
+MODE_OFFSET = 9
+KEYCODE_OFFSET = 11
+MODE_EFFECT = 0x00
+MODE_STATIC = 0x01
+
+_EMPTY_FRAGMENTS = bytes(NB_KEYS * KEY_FRAGMENT_LEN)
+
+REFRESH_PACKET = bytes([0x09] + [0x00] * 63)
+
+
+class KeyColorsPacket:
+    """Preallocated 0x0e packet of one region, updated in place.
+
+    The header and trailer are written once. Keys are written at fixed slots
+    through a memoryview, and the packet goes to HIDAPI through a ctypes
+    array sharing the same memory, so no object is allocated per key or per
+    report. Slots that were never written stay zeroed, like the padding of a
+    packet holding fewer than NB_KEYS keys.
+
+    MSIKeyboard keeps one of these per region as the state of the keyboard,
+    so a region sent again holds every key set in it so far, not only the
+    changed ones. The report has a fixed size whatever the number of keys it
+    holds, so this costs nothing more on the wire, and resending a key in
+    the color it already has leaves it unchanged.
+    """
+
+    def __init__(self, region, buffer=None):
+        # buffer can be a memoryview on a larger bytearray holding several packets
+        self.region = region
+        self.buffer = bytearray(KEY_COLORS_PACKET_LEN) if buffer is None else buffer
+        self.buffer[:HEADER_LEN] = bytes([0x0e, 0x00, REGION_ID_CODES[region], 0x00])
+        self.buffer[-len(TRAILER) :] = TRAILER
+        self.view = memoryview(self.buffer)
+        self.c_buffer = (ct.c_char * KEY_COLORS_PACKET_LEN).from_buffer(self.buffer)
+
+    def set_key(self, slot, keycode, rgb):
+        """Write a steady color at the given slot, False if it was already there"""
+        view = self.view
+        offset = HEADER_LEN + slot * KEY_FRAGMENT_LEN
+        r, g, b = rgb
+        if (
+            view[offset + MODE_OFFSET] == MODE_STATIC
+            and view[offset + KEYCODE_OFFSET] == keycode
+            and view[offset] == r
+            and view[offset + 1] == g
+            and view[offset + 2] == b
+        ):
+            return False
+
+        view[offset] = r
+        view[offset + 1] = g
+        view[offset + 2] = b
+        view[offset + EFFECT_ID_OFFSET] = 0
+        view[offset + MODE_OFFSET] = MODE_STATIC
+        view[offset + KEYCODE_OFFSET] = keycode
+        return True
+
+    def set_key_effect(self, slot, keycode, effect_id):
+        """Link the key at the given slot to an effect sent with make_effect_packet"""
+        view = self.view
+        offset = HEADER_LEN + slot * KEY_FRAGMENT_LEN
+        view[offset : offset + KEY_FRAGMENT_LEN] = _EMPTY_FRAGMENTS[:KEY_FRAGMENT_LEN]
+        view[offset + EFFECT_ID_OFFSET] = effect_id
+        view[offset + MODE_OFFSET] = MODE_EFFECT
+        view[offset + KEYCODE_OFFSET] = keycode
+
+    def clear(self):
+        self.view[HEADER_LEN : HEADER_LEN + len(_EMPTY_FRAGMENTS)] = _EMPTY_FRAGMENTS
+
+    def is_empty(self):
+        fragments = self.view[HEADER_LEN : HEADER_LEN + len(_EMPTY_FRAGMENTS)]
+        return fragments == _EMPTY_FRAGMENTS
+
+    def __len__(self):
+        return KEY_COLORS_PACKET_LEN
+
+    def __bytes__(self):
+        return bytes(self.buffer)
 
 
 def make_key_colors_packet(region, colors_map):
 
-    packet = []
+    packet = KeyColorsPacket(region)
+    for slot, (keycode, rgb) in enumerate(colors_map.items()):
+        packet.set_key(slot, keycode, rgb)
 
-    region_hexcode = REGION_ID_CODES[region]
-    header = [0x0e, 0x00, region_hexcode, 0x00]
-    packet += header
+    return packet.buffer
 
-    k = 0
-    for keycode, rgb in colors_map.items():
 
-        key_fragment = rgb + [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00] + [keycode]
-        packet += key_fragment
-        k += 1
+# 0x0b effect packets, see documentation/0b_packet_information/msi-kb-effectdoc
+EFFECT_PACKET_LEN = 524
+MAX_TRANSITIONS = 16
+TRANSITION_LEN = 8
+TRANSITIONS_OFFSET = 0x02
+START_COLOR_OFFSET = 0x84
+SEPARATOR_OFFSET = 0x8a
+WAVE_OFFSET = 0x8c
+TRANSITION_COUNT_OFFSET = 0x96
+TOTAL_DURATION_OFFSET = 0x98
+WAVE_INWARD_OFFSET = 0x9a
 
-    while k < NB_KEYS:
+# Colors are 12.4 fixed point numbers in effects, deltas are per millisecond
+COLOR_SHIFT = 4
+COLOR_MAX = 0xff << COLOR_SHIFT
+DELTA_MIN, DELTA_MAX = -128, 127
+# Durations are 16 bits millisecond counts, for the effect as a whole too
+MAX_EFFECT_DURATION = 0xffff
 
-        packet += ([0x00] * 12)
-        k += 1
+WAVE_X_MAX = 0x105c
+WAVE_Y_MAX = 0x040d
+WAVELENGTH_MIN, WAVELENGTH_MAX = 0x1f, 0x3e9
 
-    packet += [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x08, 0x39]
+# A color the key fades to, over a duration in milliseconds
+Transition = namedtuple("Transition", ["color", "duration"])
 
-    return packet
+# x, y and wavelength are fractions of the keyboard width, height and wavelength range.
+# radiate_x and radiate_y tell in which directions the wave spreads from (x, y).
+Wave = namedtuple("Wave", ["x", "y", "radiate_x", "radiate_y", "wavelength", "inward"])
 
+DEFAULT_WAVE = Wave(
+    x=0.0, y=0.5, radiate_x=True, radiate_y=False, wavelength=0.3, inward=False
+)
+
+# The controller loops over the transitions, starting from start_color
+Effect = namedtuple("Effect", ["start_color", "transitions", "wave"])
+
+
+def breathing_effect(color, period):
+    half = period // 2
+    transitions = [Transition(color, half), Transition([0, 0, 0], period - half)]
+    return Effect([0, 0, 0], transitions, None)
+
+
+def color_cycle_effect(colors, period):
+    step = period // len(colors)
+    transitions = [Transition(c, step) for c in colors[1:] + colors[:1]]
+    return Effect(colors[0], transitions, None)
+
+
+def wave_effect(colors, period, wave):
+    return color_cycle_effect(colors, period)._replace(wave=wave)
 
-def make_refresh_packet():
 
-    packet = [0x09] + [0x00] * 63
+EFFECTS = {
+    "breathing": lambda colors, period: breathing_effect(colors[0], period),
+    "color-cycle": color_cycle_effect,
+    "wave": lambda colors, period: wave_effect(colors, period, DEFAULT_WAVE),
+}
+
+
+def _put_u16(packet, offset, value):
+    packet[offset] = value & 0xff
+    packet[offset + 1] = (value >> 8) & 0xff
+
+
+def _segment_steps(current, target, duration, exact_channels):
+    # A channel changing by d runs at d // duration units per ms, and one
+    # unit faster for d % duration ms, first or last, reaching its target
+    # exactly. The order giving the channels the fewest distinct switching
+    # points is used. Other channels run at their rounded rate for the whole
+    # duration, or the truncated one if rounding would go out of range.
+    rates = []
+    switches = []
+    for channel in range(3):
+        change = target[channel] - current[channel]
+        if channel in exact_channels:
+            rate, remainder = divmod(change, duration)
+            rates.append((rate, rate + 1))
+            switches.append((duration - remainder, remainder))
+        else:
+            rate = round(change / duration)
+            if not 0 <= current[channel] + rate * duration <= COLOR_MAX:
+                rate = int(change / duration)
+            rates.append((rate, rate))
+            switches.append((duration,))
+
+    def breakpoints(orders):
+        return {0, duration} | {switch for switch in orders if 0 < switch < duration}
+
+    orders = min(product(*switches), key=lambda orders: len(breakpoints(orders)))
+    points = sorted(breakpoints(orders))
+    steps = []
+    for start, end in zip(points, points[1:]):
+        deltas = []
+        for (slow, fast), options, switch in zip(rates, switches, orders):
+            slow_first = switch == options[0]
+            before = start < switch
+            deltas.append(slow if before == slow_first else fast)
+        steps.append((deltas, end - start))
+    return steps
+
+
+def transition_steps(current, target, duration, max_steps):
+    """[(deltas, duration), ...] fading the 12.4 color current to target.
+
+    Deltas are whole units per millisecond, so a slow fade truncated to a
+    single delta would not move at all. Each channel rather alternates
+    between two rates, and the fade is cut into as many segments as
+    max_steps allows, so that it stays smooth. If even one segment needs
+    more steps, the channels closest to a whole rate are rounded to it.
+    """
+    for parts in range(min(max_steps, duration), 0, -1):
+        steps = []
+        start, elapsed = current, 0
+        for part in range(1, parts + 1):
+            end = duration * part // parts
+            part_target = [
+                c + (t - c) * end // duration for c, t in zip(current, target)
+            ]
+            steps += _segment_steps(start, part_target, end - elapsed, range(3))
+            start, elapsed = part_target, end
+        if len(steps) <= max_steps:
+            return steps
+
+    def rounding_error(channel):
+        change = target[channel] - current[channel]
+        return abs(change - round(change / duration) * duration)
+
+    exact_channels = sorted(range(3), key=rounding_error, reverse=True)
+    while True:
+        steps = _segment_steps(current, target, duration, exact_channels)
+        if len(steps) <= max_steps:
+            return steps
+        exact_channels.pop()
+
+
+def make_effect_packet(effect_id, effect):
+
+    if not 0 < len(effect.transitions) <= MAX_TRANSITIONS:
+        raise ValueError(
+            "An effect needs between 1 and %d transitions" % MAX_TRANSITIONS
+        )
+
+    # Each transition takes one or more steps of the packet, sharing them
+    # evenly. Deltas are computed from the color the controller actually
+    # reaches, so that a delta clipped on a short step gets compensated later.
+    steps = []
+    current = [c << COLOR_SHIFT for c in effect.start_color]
+    for i, (color, duration) in enumerate(effect.transitions):
+        duration = max(1, int(duration))
+        target = [c << COLOR_SHIFT for c in color]
+        share = (MAX_TRANSITIONS - len(steps)) // (len(effect.transitions) - i)
+        for deltas, step_duration in transition_steps(
+            current, target, duration, share
+        ):
+            deltas = [max(DELTA_MIN, min(DELTA_MAX, delta)) for delta in deltas]
+            current = [
+                max(0, min(COLOR_MAX, c + delta * step_duration))
+                for c, delta in zip(current, deltas)
+            ]
+            steps.append((deltas, step_duration))
+
+    total_duration = sum(duration for _, duration in steps)
+    if total_duration > MAX_EFFECT_DURATION:
+        raise ValueError("Effects last at most %d ms" % MAX_EFFECT_DURATION)
+
+    packet = bytearray(EFFECT_PACKET_LEN)
+    packet[0] = 0x0b
+
+    for i, (deltas, duration) in enumerate(steps):
+        offset = TRANSITIONS_OFFSET + i * TRANSITION_LEN
+        packet[offset] = effect_id if i == 0 else i
+        for channel, delta in enumerate(deltas):
+            packet[offset + 2 + channel] = delta & 0xff
+        _put_u16(packet, offset + 6, duration)
+
+    for channel in range(3):
+        _put_u16(
+            packet,
+            START_COLOR_OFFSET + 2 * channel,
+            effect.start_color[channel] << COLOR_SHIFT,
+        )
+    packet[SEPARATOR_OFFSET] = 0xff
+
+    wave = effect.wave
+    if wave is not None:
+        wavelength_range = WAVELENGTH_MAX - WAVELENGTH_MIN
+        wavelength = WAVELENGTH_MIN + wavelength_range * wave.wavelength
+        _put_u16(packet, WAVE_OFFSET, int(wave.x * WAVE_X_MAX))
+        _put_u16(packet, WAVE_OFFSET + 2, int(wave.y * WAVE_Y_MAX))
+        _put_u16(packet, WAVE_OFFSET + 4, int(bool(wave.radiate_x)))
+        _put_u16(packet, WAVE_OFFSET + 6, int(bool(wave.radiate_y)))
+        _put_u16(packet, WAVE_OFFSET + 8, int(wavelength))
+        packet[WAVE_INWARD_OFFSET] = int(bool(wave.inward))
+
+    packet[TRANSITION_COUNT_OFFSET] = len(steps)
+    _put_u16(packet, TOTAL_DURATION_OFFSET, total_duration)
 
     return packet
+
+
+def make_refresh_packet():
+
+    return REFRESH_PACKET
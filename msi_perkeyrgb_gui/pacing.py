@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+from json import JSONDecodeError
+
+from .hidapi_wrapping import DELAY, HIDSendError
+from .paths import cache_path
+from .protocol_data.pacing_index import REPORT_GAPS
+
+log = logging.getLogger(__name__)
+
+PACING_CACHE_FILE = "pacing.json"
+
+# Gaps tried by the calibration, from the safest to the most aggressive
+CALIBRATION_GAPS = [0.02, 0.015, 0.01, 0.008, 0.006, 0.005, 0.004, 0.003]
+CALIBRATION_FRAMES = 20
+# The gap stored is the smallest one accepted times the margin, and never
+# below the floor, whatever the keyboard seemed to accept
+CALIBRATION_MARGIN = 1.5
+MIN_CALIBRATED_GAP = DELAY / 2
+# Colors the keyboard is set to after each burst, for the user to check
+CHECK_COLORS = [("red", [255, 0, 0]), ("green", [0, 255, 0]), ("blue", [0, 0, 255])]
+
+
+class CalibrationError(Exception):
+    pass
+
+
+def _load_cache():
+    try:
+        with open(cache_path(PACING_CACHE_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, JSONDecodeError):
+        return {}
+
+
+def load_cached_gap(msi_model):
+    gap = _load_cache().get(msi_model)
+    # Gaps below the floor come from older, unchecked calibrations
+    if isinstance(gap, (int, float)) and gap >= MIN_CALIBRATED_GAP:
+        return gap
+
+
+def store_cached_gap(msi_model, gap):
+    cache = _load_cache()
+    cache[msi_model] = gap
+
+    path = cache_path(PACING_CACHE_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(cache, f, indent=2)
+
+
+def get_model_min_gap(msi_model):
+    """Minimum gap between reports: calibrated value if any, else model default"""
+    gap = load_cached_gap(msi_model)
+    if gap is not None:
+        return gap
+
+    for msi_models, gap in REPORT_GAPS:
+        if msi_model in msi_models:
+            return gap
+
+    return DELAY
+
+
+def _try_gap(kb, frames, check_color, confirm):
+    # Reason for rejecting the gap, None if the keyboard took every report
+    dropped = kb.dropped_reports
+    try:
+        for _ in range(frames):
+            kb.invalidate()
+            kb.set_random_color_all()
+            kb.refresh()
+        # A report dropped at the end of the burst leaves some keys in
+        # another color
+        name, rgb = check_color
+        kb.set_color_all(rgb)
+        kb.refresh()
+    except HIDSendError as e:
+        return str(e)
+
+    if dropped is not None and kb.dropped_reports > dropped:
+        return "%d reports ignored" % (kb.dropped_reports - dropped)
+    if confirm is not None and not confirm(name):
+        return "keys not all %s" % name
+    return None
+
+
+def calibrate_pacing(
+    kb, gaps=CALIBRATION_GAPS, frames=CALIBRATION_FRAMES, confirm=None
+):
+    """Find a safe gap from the smallest one at which the keyboard takes a burst
+    of full frames.
+
+    The controller does not report the reports it ignores. A gap is rejected
+    when a send fails, when the HID backend counts ignored reports (as the
+    simulated keyboard does), or when confirm(color name) returns False, the
+    keyboard being set to that color after each burst. Without a dropped
+    report count, confirm is required.
+
+    Gaps are tried in decreasing order, and the search stops at the first
+    rejected one. Returns the last accepted gap times CALIBRATION_MARGIN, at
+    least MIN_CALIBRATED_GAP, or None if every gap was rejected.
+    """
+    if kb.dropped_reports is None and confirm is None:
+        raise CalibrationError("This keyboard cannot tell if it ignored reports")
+
+    pacer = kb.pacer
+    initial_gap = pacer.min_gap
+    safe_gap = None
+
+    try:
+        for i, gap in enumerate(gaps):
+            pacer.min_gap = gap
+            error = _try_gap(kb, frames, CHECK_COLORS[i % len(CHECK_COLORS)], confirm)
+            if error is not None:
+                log.info("Gap of %.1f ms rejected: %s", gap * 1000, error)
+                break
+            log.info("Gap of %.1f ms accepted", gap * 1000)
+            safe_gap = gap
+    finally:
+        pacer.min_gap = initial_gap
+
+    if safe_gap is None:
+        return None
+    return max(safe_gap * CALIBRATION_MARGIN, MIN_CALIBRATED_GAP)
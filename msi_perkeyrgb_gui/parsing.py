@@ -1,8 +1,6 @@
 import re
 from typing import Tuple
 
-import webcolors
-
 
 class UnknownIdError(Exception):
     pass
@@ -35,12 +33,13 @@ def parse_preset(preset_arg, msi_presets):
 
 def parse_color(color: str) -> str:
     _color = color.lower()
-    try:
-        _color = webcolors.name_to_hex(_color)[1:]
-    except ValueError:
-        pass
-
     if re.fullmatch("^[0-9a-f]{6}$", _color):  # Color in HTML notation
         return _color
-    else:
+
+    # webcolors is only imported when a color name is actually used
+    import webcolors
+
+    try:
+        return webcolors.name_to_hex(_color)[1:]
+    except ValueError:
         raise ColorParseError(f"{color} is not a valid color")
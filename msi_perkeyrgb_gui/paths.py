@@ -0,0 +1,12 @@
+import os
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "msi-perkeyrgb-gui")
+
+
+def cache_path(*parts):
+    return os.path.join(cache_dir(), *parts)
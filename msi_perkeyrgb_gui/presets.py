@@ -0,0 +1,127 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+from .paths import cache_path
+
+log = logging.getLogger(__name__)
+
+PRESETS_DIR = os.path.join(os.path.dirname(__file__), "protocol_data", "presets")
+
+# Compiled presets file :
+#   header  : magic, source JSON mtime (ns) and size, number of presets
+#   index   : for each preset, name length, name, data offset, number of reports
+#   data    : for each report, length and the report itself
+PRESETS_MAGIC = b"MSIP\x01"
+HEADER = struct.Struct("<5sQQH")
+INDEX_ENTRY = struct.Struct("<IH")
+REPORT_LEN = struct.Struct("<H")
+
+
+def compile_presets(json_path):
+    """Turn a presets JSON file into the compiled binary format"""
+    with open(json_path) as f:
+        presets = json.load(f)
+    stat = os.stat(json_path)
+
+    names = [name.encode() for name in presets]
+    index_size = sum(1 + len(name) + INDEX_ENTRY.size for name in names)
+
+    index = []
+    data = []
+    offset = HEADER.size + index_size
+    for name, reports in zip(names, presets.values()):
+        index += [bytes([len(name)]), name, INDEX_ENTRY.pack(offset, len(reports))]
+        for report in reports:
+            report = bytes.fromhex(report)
+            data += [REPORT_LEN.pack(len(report)), report]
+            offset += REPORT_LEN.size + len(report)
+
+    header = HEADER.pack(PRESETS_MAGIC, stat.st_mtime_ns, stat.st_size, len(names))
+    return b"".join([header] + index + data)
+
+
+class PresetStore(Mapping):
+    """Vendor presets of a model, as {name: [report bytes, ...]}.
+
+    Nothing is read until a preset is listed or requested. The JSON file is
+    compiled once into an indexed binary file in the cache directory, which
+    is then memory-mapped, so that only the requested preset is decoded.
+    """
+
+    def __init__(self, filename):
+        self.json_path = os.path.join(PRESETS_DIR, filename)
+        self.bin_path = cache_path("presets", os.path.splitext(filename)[0] + ".bin")
+        self._data = None
+        self._index = None
+
+    def _is_fresh(self, data):
+        if len(data) < HEADER.size:
+            return False
+        magic, mtime_ns, size, _ = HEADER.unpack_from(data)
+        stat = os.stat(self.json_path)
+        return (
+            magic == PRESETS_MAGIC
+            and mtime_ns == stat.st_mtime_ns
+            and size == stat.st_size
+        )
+
+    def _open(self):
+        try:
+            with open(self.bin_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._is_fresh(data):
+                return data
+            data.close()
+        except (OSError, ValueError):
+            pass
+
+        data = compile_presets(self.json_path)
+        try:
+            os.makedirs(os.path.dirname(self.bin_path), exist_ok=True)
+            tmp_path = "%s.%d.tmp" % (self.bin_path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.bin_path)
+        except OSError as e:
+            log.warning("Cannot write compiled presets : %s", e)
+        return data
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+
+        data = self._open()
+        _, _, _, count = HEADER.unpack_from(data)
+        index = {}
+        offset = HEADER.size
+        for _ in range(count):
+            name_len = data[offset]
+            name = bytes(data[offset + 1 : offset + 1 + name_len]).decode()
+            offset += 1 + name_len
+            index[name] = INDEX_ENTRY.unpack_from(data, offset)
+            offset += INDEX_ENTRY.size
+
+        self._data = data
+        self._index = index
+        return index
+
+    def __getitem__(self, name):
+        offset, count = self._load_index()[name]
+        data = self._data
+        reports = []
+        for _ in range(count):
+            (size,) = REPORT_LEN.unpack_from(data, offset)
+            offset += REPORT_LEN.size
+            reports.append(bytes(data[offset : offset + size]))
+            offset += size
+        return reports
+
+    def __iter__(self):
+        return iter(self._load_index())
+
+    def __len__(self):
+        return len(self._load_index())
@@ -0,0 +1,21 @@
+# Minimum gap in seconds between two reports, per model.
+# Models that are not listed use hidapi_wrapping.DELAY.
+REPORT_GAPS = [
+    (
+        [
+            "GE63",
+            "GE73",
+            "GE75",
+            "GS63",
+            "GS73",
+            "GS75",
+            "GX63",
+            "GT63",
+            "GL63",
+            "GP75",
+            "GL73",
+        ],
+        0.01,
+    ),
+    (["GS65"], 0.01),
+]
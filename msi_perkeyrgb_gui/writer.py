@@ -0,0 +1,440 @@
+import logging
+import threading
+from collections import deque
+from functools import partial
+from time import monotonic
+
+from .hidapi_wrapping import HIDNotFoundError, HIDOpenError, HIDSendError
+from .hotplug import REOPEN_TIMEOUT
+from .metrics import get_metrics
+
+log = logging.getLogger(__name__)
+
+SYNC_TIMEOUT = 1.0  # seconds synchronized keyboards wait for each other
+RETRY_INTERVAL = 1.0  # seconds between reopen attempts of a missing keyboard
+
+_COLORS = "colors"
+_CALL = "call"
+
+
+class KeyboardUnavailableError(Exception):
+    pass
+
+
+def merge_frame(stats, pending, linux_colors_map):
+    """Merge colors into a pending frame, counting it as merged or dropped"""
+    metrics = get_metrics()
+    if pending.keys() <= linux_colors_map.keys():
+        stats.dropped += 1
+        if metrics is not None:
+            metrics.add("frames_dropped")
+    else:
+        stats.merged += 1
+        if metrics is not None:
+            metrics.add("frames_merged")
+    pending.update(linux_colors_map)
+
+
+class WriterStats:
+    def __init__(self):
+        self.submitted = 0
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.max_latency = 0.0
+
+    def __str__(self):
+        return (
+            "%d frames submitted, %d sent, %d merged, %d dropped, max latency %.1f ms"
+            % (
+                self.submitted,
+                self.sent,
+                self.merged,
+                self.dropped,
+                self.max_latency * 1000,
+            )
+        )
+
+
+class KeyboardWriter:
+    """Background thread owning an MSIKeyboard, sending the latest colors.
+
+    Producers call submit() with {linux keycode: color} maps and never wait
+    for the controller. Frames submitted while a send is in flight are merged
+    into a single pending frame, newer colors overriding older ones, and the
+    writer sends that frame as soon as the previous one is done. A pending
+    frame whose keys are all overridden is dropped as a whole. Latency is
+    thus bounded by the duration of about two frames, whatever the producer
+    rate, and the keyboard ends up in the same state as if every frame had
+    been sent.
+
+    Other keyboard operations are queued with call(), in order with the
+    frames. The keyboard can be given, or opened on first use on the writer
+    thread with open_keyboard, which returns None when it cannot be opened.
+
+    A keyboard that stops answering does not stop the writer : frames keep
+    updating the keyboard state, which is replayed once reconnect() finds
+    the keyboard again (see hotplug.HotplugMonitor). Frames arriving
+    meanwhile also try to reopen it, every RETRY_INTERVAL seconds, in case
+    its return was missed. They are not counted as sent.
+
+    Once the writer is started, the keyboard must only be used through it.
+    """
+
+    def __init__(self, kb=None, open_keyboard=None, clock=monotonic):
+        self.kb = kb
+        self.stats = WriterStats()
+        self.error = None
+        self._open_keyboard = open_keyboard
+        self._clock = clock
+        self._cond = threading.Condition()
+        # [kind, payload, submit time] items, a colors item is only ever
+        # followed by a call item, so the queue stays short
+        self._queue = deque()
+        self._busy = False
+        self._stopping = False
+        self._thread = None
+        self._next_retry = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="msi-keyboard-writer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def submit(self, linux_colors_map):
+        """Queue colors to send, without blocking. False if the writer stopped."""
+        with self._cond:
+            if self._stopping or self.error is not None:
+                return False
+
+            stats = self.stats
+            stats.submitted += 1
+            queue = self._queue
+            if queue and queue[-1][0] == _COLORS:
+                merge_frame(stats, queue[-1][1], linux_colors_map)
+            else:
+                queue.append([_COLORS, dict(linux_colors_map), self._clock()])
+            self._cond.notify()
+        return True
+
+    def call(self, func, on_done=None):
+        """Queue func() to run on the writer thread, after the frames submitted so far.
+
+        on_done(result, error) is then called on the writer thread, error
+        being the exception raised by func, if any. False if the writer stopped.
+        """
+        with self._cond:
+            if self._stopping or self.error is not None:
+                return False
+            self._queue.append([_CALL, (func, on_done), self._clock()])
+            self._cond.notify()
+        return True
+
+    def reconnect(self, added_paths=None):
+        """Queue the reopening of a disconnected keyboard and the replay of its state"""
+        return self.call(lambda: self._reopen(REOPEN_TIMEOUT))
+
+    def disconnect(self, removed_paths=None):
+        """Queue the closing of the keyboard, if its node is among removed_paths"""
+
+        def disconnect():
+            if self.kb is not None:
+                self.kb.disconnect(removed_paths)
+
+        return self.call(disconnect)
+
+    def keyboard(self):
+        """The keyboard, opened if needed. Only for functions run through call()."""
+        if self.kb is None:
+            if self._open_keyboard is not None:
+                self.kb = self._open_keyboard()
+            if self.kb is None:
+                raise KeyboardUnavailableError("Cannot open keyboard")
+        return self.kb
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is done, False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not (self._queue or self._busy) or self.error is not None,
+                timeout,
+            )
+
+    def close(self, timeout=None):
+        """Finish what is still queued and stop the thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _take(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self._stopping)
+            if not self._queue:
+                return None
+
+            item = self._queue.popleft()
+            if item[0] == _COLORS:
+                latency = self._clock() - item[2]
+                self.stats.max_latency = max(self.stats.max_latency, latency)
+            self._busy = True
+            return item
+
+    def _done(self, error=None):
+        with self._cond:
+            if error is not None:
+                self.error = error
+                self._queue.clear()
+            self._busy = False
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+
+            kind, payload, _ = item
+            if kind == _CALL:
+                self._run_call(*payload)
+                self._done()
+                continue
+
+            try:
+                sent = self.apply(lambda kb: kb.set_colors(payload))
+            except Exception as e:
+                log.error("Keyboard writer stopped : %s", e)
+                self._done(e)
+                return
+
+            if sent:
+                self.stats.sent += 1
+            self._done()
+
+    def apply(self, update, barrier=None):
+        """Run update(kb) then refresh the keyboard, on the writer thread.
+
+        With a barrier, the keyboards sharing it are refreshed together. A
+        keyboard that stops answering, or is still missing, keeps its state
+        for reconnect(), and False is returned.
+        """
+        kb = self.keyboard()
+        if not kb.connected:
+            self._retry_reopen()
+        try:
+            update(kb)
+            if not kb.connected:
+                # Only the state was updated, for the replay
+                if barrier is not None:
+                    barrier.abort()
+                return False
+            if barrier is not None:
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    pass  # Another keyboard failed, this one is refreshed anyway
+            kb.refresh()
+        except HIDSendError as e:
+            if barrier is not None:
+                barrier.abort()
+            # Stale handle after a suspend or an unplug, the frame is kept
+            log.warning("Keyboard stopped answering : %s", e)
+            self._reopen(0)
+            return False
+        return True
+
+    def _retry_reopen(self):
+        now = self._clock()
+        if self._next_retry is not None and now < self._next_retry:
+            return
+        self._next_retry = now + RETRY_INTERVAL
+        self._reopen(0)
+
+    def _reopen(self, timeout):
+        # A keyboard not opened yet is opened on first use anyway
+        if self.kb is None or self.kb.connected:
+            return
+        try:
+            self.kb.reopen(timeout)
+        except (HIDNotFoundError, HIDOpenError, HIDSendError) as e:
+            log.warning("Keyboard not available, waiting for it : %s", e)
+        else:
+            log.info("Keyboard reopened and state restored")
+
+    def _run_call(self, func, on_done):
+        result = error = None
+        try:
+            result = func()
+        except Exception as e:
+            error = e
+        if on_done is not None:
+            on_done(result, error)
+        elif error is not None:
+            log.error("Keyboard operation failed : %s", error)
+
+
+class KeyboardGroup:
+    """Several keyboards driven in parallel, each by its own KeyboardWriter.
+
+    Every keyboard has its own writer thread and report pacing, so a frame
+    reaches N keyboards in about the time it takes to reach one. Frames are
+    merged per keyboard, the way KeyboardWriter does.
+
+    When synchronized, each frame is sent to every keyboard, which then wait
+    for each other before applying it with the refresh report. Frames
+    submitted meanwhile are merged until the slowest keyboard is done.
+
+    Keyboards an update queued with call() could not be applied to, missing,
+    not answering or stopped, are counted in `unapplied`.
+    """
+
+    def __init__(self, keyboards, synchronized=False):
+        self.writers = [KeyboardWriter(kb) for kb in keyboards]
+        self.synchronized = synchronized
+        self.stats = WriterStats()  # Frames of the group, when synchronized
+        self.error = None
+        self.unapplied = 0
+        self._cond = threading.Condition()
+        self._pending = None
+        self._in_flight = 0
+        self._frame_sent = False
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+        return self
+
+    def submit(self, linux_colors_map):
+        """Queue colors for every keyboard, without blocking. False if stopped."""
+        if not self.synchronized:
+            return all([writer.submit(linux_colors_map) for writer in self.writers])
+
+        with self._cond:
+            if self.error is not None:
+                return False
+            self.stats.submitted += 1
+            if self._pending is not None:
+                merge_frame(self.stats, self._pending, linux_colors_map)
+            elif self._in_flight:
+                self._pending = dict(linux_colors_map)
+            else:
+                self._dispatch(dict(linux_colors_map))
+        return True
+
+    def call(self, update):
+        """Queue update(kb) on every keyboard, each one being refreshed after it.
+
+        Synchronized keyboards are refreshed together, the frames in flight
+        being applied first. False if stopped.
+        """
+        if not self.synchronized:
+            queued = [
+                writer.call(partial(writer.apply, update), self._call_done)
+                for writer in self.writers
+            ]
+            with self._cond:
+                self.unapplied += queued.count(False)
+            return all(queued)
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._idle() or self.error is not None)
+            if self.error is not None:
+                self.unapplied += len(self.writers)
+                return False
+            self._dispatch_update(update, counted=True)
+        return True
+
+    def reconnect(self, added_paths=None):
+        for writer in self.writers:
+            writer.reconnect(added_paths)
+
+    def disconnect(self, removed_paths=None):
+        for writer in self.writers:
+            writer.disconnect(removed_paths)
+
+    def flush(self, timeout=None):
+        """Wait until every keyboard is done with what was queued so far"""
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._idle() or self.error is not None, timeout
+            ):
+                return False
+        return all([writer.flush(timeout) for writer in self.writers])
+
+    def close(self, timeout=None):
+        """Finish what is still queued and stop the writer threads"""
+        self.flush(timeout)
+        for writer in self.writers:
+            writer.close(timeout)
+        if self.error is None:
+            self.error = next((w.error for w in self.writers if w.error), None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __str__(self):
+        if self.synchronized or len(self.writers) == 1:
+            stats = self.stats if self.synchronized else self.writers[0].stats
+            return str(stats)
+        return ", ".join(
+            "keyboard %d : %s" % (i + 1, writer.stats)
+            for i, writer in enumerate(self.writers)
+        )
+
+    def _idle(self):
+        return not self._in_flight and self._pending is None
+
+    def _dispatch(self, frame):
+        self._dispatch_update(lambda kb: kb.set_colors(frame))
+
+    def _dispatch_update(self, update, counted=False):
+        # Called with the lock held, the last keyboard done sends the pending frame
+        barrier = threading.Barrier(len(self.writers), timeout=SYNC_TIMEOUT)
+        self._in_flight = len(self.writers)
+        self._frame_sent = False
+        done = partial(self._done, counted)
+        for writer in self.writers:
+            if not writer.call(partial(writer.apply, update, barrier), done):
+                barrier.abort()
+                self._in_flight -= 1
+                if counted:
+                    self.unapplied += 1
+
+    def _call_done(self, sent, error):
+        with self._cond:
+            if error is not None:
+                log.error("Keyboard operation failed : %s", error)
+            if not sent:
+                self.unapplied += 1
+
+    def _done(self, counted, sent, error):
+        with self._cond:
+            if error is not None and self.error is None:
+                log.error("Keyboard group stopped : %s", error)
+                self.error = error
+            if counted and not sent:
+                self.unapplied += 1
+            self._in_flight -= 1
+            self._frame_sent = self._frame_sent or bool(sent)
+            if self._in_flight:
+                return
+
+            # Not counted if every keyboard is missing
+            if self._frame_sent:
+                self.stats.sent += 1
+            if self._pending is not None and self.error is None:
+                frame, self._pending = self._pending, None
+                self._dispatch(frame)
+            self._cond.notify_all()
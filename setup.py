@@ -3,7 +3,7 @@ from os.path import dirname, join
 
 from setuptools import setup, find_packages
 
-from msi_perkeyrgb_gui.main import __version__
+from msi_perkeyrgb_gui import __version__
 
 setup(
     name="msi-perkeyrgb-gui",
@@ -33,5 +33,6 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3",
     ],
-    install_requires=["webcolors", "pydantic"],
+    install_requires=["webcolors"],
+    extras_require={"numpy": ["numpy"]},
 )
@@ -0,0 +1,41 @@
+import pytest
+
+from msi_perkeyrgb_gui.hidapi_wrapping import HID_Keyboard
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard
+
+MODEL = "GP75"
+
+
+class FakeClock:
+    """Monotonic clock only moved by sleep(), which can oversleep by jitter"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.jitter = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds + self.jitter
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_keyboard():
+    """make_keyboard(backend, min_gap=0) : a GP75 MSIKeyboard over backend,
+    usually a SimulatedKeyboard, with reports paced by min_gap seconds"""
+
+    def make(backend, min_gap=0):
+        return MSIKeyboard(
+            None,
+            MSIKeyboard.get_model_keymap(MODEL),
+            MSIKeyboard.get_model_presets(MODEL),
+            hid_keyboard=HID_Keyboard(None, min_gap, backend=backend),
+        )
+
+    return make
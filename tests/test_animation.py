@@ -0,0 +1,132 @@
+import pytest
+
+from msi_perkeyrgb_gui.animation import (
+    FPS_HEADROOM,
+    REPORTS_PER_FRAME,
+    Animator,
+    AnimationStats,
+    FrameClock,
+    max_fps,
+    rainbow_wave,
+)
+from msi_perkeyrgb_gui.hid_sim import SimulatedKeyboard
+from msi_perkeyrgb_gui.hidapi_wrapping import ReportPacer
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard
+
+MODEL = "GP75"
+
+
+class FakeKeyboard:
+    """Takes `latency` seconds of the fake clock per frame"""
+
+    def __init__(self, clock, latency, min_gap=0):
+        self.pacer = ReportPacer(min_gap)
+        self.clock = clock
+        self.latency = latency
+        self.frame_times = []
+
+    def set_colors(self, colors_map):
+        self.frame_times.append(self.clock())
+
+    def refresh(self):
+        self.clock.now += self.latency
+
+
+def recording_effect(timestamps):
+    def effect(t):
+        timestamps.append(t)
+        return {}
+
+    return effect
+
+
+def test_frames_start_on_the_deadline_grid_without_drift(clock):
+    clock.jitter = 0.003
+    kb = FakeKeyboard(clock, latency=0.001)
+    timestamps = []
+    animator = Animator(kb, recording_effect(timestamps), 50, clock, clock.sleep)
+
+    stats = animator.run(frames=200)
+
+    interval = 1 / 50
+    assert stats.frames == 200
+    assert stats.missed_deadlines == 0
+    assert stats.skipped_frames == 0
+    assert timestamps == pytest.approx([i * interval for i in range(200)])
+    # Sleep jitter delays each frame a little, but never adds up
+    for i, start in enumerate(kb.frame_times):
+        assert i * interval <= start <= i * interval + 0.003 + 1e-9
+
+
+def test_frames_that_cannot_be_on_time_are_skipped(clock):
+    kb = FakeKeyboard(clock, latency=0.125)  # 2.5 frame intervals
+    timestamps = []
+    animator = Animator(kb, recording_effect(timestamps), 20, clock, clock.sleep)
+
+    stats = animator.run(duration=1.0)
+
+    interval = 1 / 20
+    assert stats.skipped_frames > 0
+    assert stats.missed_deadlines == stats.frames
+    # The last skip can go past the end of the animation
+    assert 20 <= stats.frames + stats.skipped_frames <= 20 + 0.125 / interval
+    # Skipped frames keep the others on the grid, sent less than a frame late
+    for t, start in zip(timestamps, kb.frame_times):
+        assert t / interval == pytest.approx(round(t / interval))
+        assert 0 <= start - t < interval
+    assert stats.max_lateness == pytest.approx(0.125)
+
+
+def test_frame_clock_waits_for_the_next_deadline(clock):
+    frame_clock = FrameClock(10, clock, clock.sleep)
+    stats = AnimationStats()
+    frame_clock.start()
+
+    clock.now = 0.03
+    frame_clock.advance(stats)
+    assert clock.now == pytest.approx(0.1)
+
+    clock.now = 0.35  # 2.5 intervals late
+    frame_clock.advance(stats)
+    assert frame_clock.frame == 3
+    assert clock.now == 0.35
+    assert stats.missed_deadlines == 1
+    assert stats.skipped_frames == 1
+
+
+def test_fps_is_capped_to_the_controller_pacing(clock):
+    kb = FakeKeyboard(clock, latency=0, min_gap=0.01)
+    animator = Animator(kb, recording_effect([]), 1000)
+    report_time = 0.01 + kb.pacer.latency
+    expected = FPS_HEADROOM / (report_time * REPORTS_PER_FRAME)
+    assert animator.fps == max_fps(kb) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("fps, skipping", [(20, False), (200, True)])
+def test_animation_against_the_simulated_keyboard(fps, skipping, clock, make_keyboard):
+    sim = SimulatedKeyboard(latency=0.002, min_gap=0, clock=clock, sleep=clock.sleep)
+    kb = make_keyboard(sim)
+    wave = rainbow_wave(MSIKeyboard.get_model_keymap(MODEL))
+    frames = []
+
+    def effect(t):
+        frames.append(wave(t))
+        return frames[-1]
+
+    stats = Animator(kb, effect, fps, clock, clock.sleep).run(duration=1.0)
+
+    refreshes = [report for report in sim.log if report.kind == "refresh"]
+    assert len(refreshes) == stats.frames == len(frames)
+    assert fps <= stats.frames + stats.skipped_frames <= fps * 1.1
+    if skipping:
+        # Every region and the refresh, at 2 ms each, take longer than a frame
+        assert stats.skipped_frames > 0
+        assert stats.achieved_fps < fps
+    else:
+        assert stats.missed_deadlines == 0
+        assert stats.frames == fps
+        assert stats.achieved_fps == pytest.approx(fps, rel=0.05)
+
+    # Nothing was sent too fast, and the keyboard shows the last frame
+    assert sim.dropped == 0
+    assert set(sim.colors().values()) == {tuple(rgb) for rgb in frames[-1].values()}
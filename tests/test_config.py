@@ -0,0 +1,68 @@
+import pytest
+
+from msi_perkeyrgb_gui.config import ConfigError, read_config_frames
+
+
+class ChunkedStream:
+    """Binary stream whose read1() returns the given chunks, one per call"""
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read1(self, size=-1):
+        return self.chunks.pop(0) if self.chunks else b""
+
+    read = read1
+
+
+def frames(*chunks, **kwargs):
+    return list(read_config_frames(ChunkedStream(*chunks), **kwargs))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"a steady red\nb steady blue\n\nc steady green\n\n",
+        b"a steady red\nb steady blue\0c steady green\0",
+        b"a steady red\nb steady blue\0\nc steady green\0\n",
+        b"a steady red\nb steady blue\n\n\n\0c steady green\n",
+    ],
+    ids=["blank lines", "NUL", "NUL and newline", "repeated separators"],
+)
+def test_frames_are_split_on_blank_lines_and_nul(data):
+    assert frames(data) == ["a steady red\nb steady blue\n", "c steady green\n"]
+
+
+def test_last_frame_needs_no_delimiter():
+    assert frames(b"a steady red\n\nb steady blue") == [
+        "a steady red\n",
+        "b steady blue\n",
+    ]
+
+
+def test_lines_split_across_chunks_are_joined():
+    assert frames(b"a ste", b"ady red\nb steady", b" blue\n", b"\n") == [
+        "a steady red\nb steady blue\n"
+    ]
+
+
+def test_whitespace_only_lines_separate_frames():
+    assert frames(b"a steady red\n  \t\nb steady blue\n \n") == [
+        "a steady red\n",
+        "b steady blue\n",
+    ]
+
+
+def test_frames_are_yielded_as_soon_as_they_end():
+    stream = ChunkedStream(b"a steady red\n\n", b"b steady blue\n\n")
+    reader = read_config_frames(stream)
+    assert next(reader) == "a steady red\n"
+    assert stream.chunks == [b"b steady blue\n\n"]
+
+
+def test_oversized_frames_are_rejected():
+    line = b"a steady red\n"
+    with pytest.raises(ConfigError):
+        frames(line * 10, max_frame_size=len(line) * 5)
+    # Frames up to the limit are fine, separators excluded
+    assert len(frames((line * 5 + b"\n") * 3, max_frame_size=len(line) * 5)) == 3
@@ -0,0 +1,82 @@
+import socket
+import sys
+import threading
+
+import pytest
+
+from msi_perkeyrgb_gui import main
+from msi_perkeyrgb_gui.daemon import REQUEST_TIMEOUT, LightingDaemon, _UnixServer
+from msi_perkeyrgb_gui.hid_sim import SimulatedKeyboard
+from msi_perkeyrgb_gui.hidapi_wrapping import BACKEND_ENV
+from msi_perkeyrgb_gui.ipc import send_command
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard
+
+MODEL = "GP75"
+USB_ID = [0x1038, 0x1122]
+
+
+def make_daemon(kb, tmp_path):
+    return LightingDaemon(
+        kb,
+        MODEL,
+        USB_ID,
+        MSIKeyboard.get_model_keymap(MODEL),
+        MSIKeyboard.get_model_presets(MODEL),
+        str(tmp_path / "daemon.sock"),
+    )
+
+
+def test_repeated_commands_are_sent_again(tmp_path, make_keyboard):
+    sim = SimulatedKeyboard(latency=0, min_gap=0)
+    daemon = make_daemon(make_keyboard(sim), tmp_path)
+
+    for cmd in [{"cmd": "steady", "color": "red"}, {"cmd": "disable"}]:
+        request = dict(cmd, model=MODEL, usb_id=USB_ID)
+        counts = []
+        # Another program may have changed the keys in between
+        for _ in range(2):
+            before = sim.reports
+            assert daemon.handle(request) == {"ok": True}
+            counts.append(sim.reports - before)
+        assert counts[0] > 0
+        assert counts[1] == counts[0]
+
+
+def test_requests_must_be_objects(tmp_path, make_keyboard):
+    daemon = make_daemon(make_keyboard(SimulatedKeyboard(latency=0)), tmp_path)
+    for request in [[], "ping", 1, None]:
+        reply = daemon.handle(request)
+        assert not reply["ok"]
+
+
+def test_silent_client_does_not_block_the_others(tmp_path, make_keyboard):
+    daemon = make_daemon(make_keyboard(SimulatedKeyboard(latency=0)), tmp_path)
+    server = _UnixServer(daemon.socket_path, daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+            silent.connect(daemon.socket_path)
+            reply = send_command(
+                {"cmd": "ping"}, daemon.socket_path, timeout=REQUEST_TIMEOUT * 3
+            )
+        assert reply == {"ok": True}
+        assert send_command([], daemon.socket_path)["ok"] is False
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_simulated_keyboard_commands_are_not_forwarded(monkeypatch):
+    monkeypatch.setenv(BACKEND_ENV, "hidapi")
+    forwarded = []
+    monkeypatch.setattr(
+        main, "forward_to_daemon", lambda *args: forwarded.append(args) or True
+    )
+    argv = ["msi-perkeyrgb-gui", "--model", MODEL, "--backend", "sim", "-s", "red"]
+    monkeypatch.setattr(sys, "argv", argv)
+
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+
+    assert exit_info.value.code == 0
+    assert forwarded == []
@@ -0,0 +1,45 @@
+import pytest
+
+from msi_perkeyrgb_gui.hid_sim import SimulatedKeyboard
+from msi_perkeyrgb_gui.hidapi_wrapping import HID_Keyboard, HIDSendError
+from msi_perkeyrgb_gui.msiprotocol import make_key_colors_packet, make_refresh_packet
+
+
+def simulated_keyboard(clock, strict=False):
+    return SimulatedKeyboard(
+        latency=0.001, min_gap=0.005, strict=strict, clock=clock, sleep=clock.sleep
+    )
+
+
+def test_reports_sent_too_fast_are_dropped_and_counted(clock):
+    sim = simulated_keyboard(clock)
+    packet = make_key_colors_packet("alphanum", {4: [255, 0, 0]})
+
+    assert sim.send_feature_report(packet) == len(packet)
+    assert sim.send_feature_report(packet) == len(packet)
+    assert sim.dropped == 1
+    assert [report.dropped for report in sim.log] == [False, True]
+
+    clock.sleep(0.005)
+    sim.write(make_refresh_packet())
+    assert sim.dropped == 1
+    assert sim.colors() == {4: (255, 0, 0)}
+
+
+def test_strict_mode_makes_dropped_reports_fail(clock):
+    sim = simulated_keyboard(clock, strict=True)
+    packet = make_key_colors_packet("alphanum", {4: [255, 0, 0]})
+
+    assert sim.send_feature_report(packet) == len(packet)
+    assert sim.send_feature_report(packet) == -1
+    assert sim.dropped == 1
+
+
+def test_hid_keyboard_reports_dropped_count_and_errors(clock):
+    hid = HID_Keyboard(None, 0, backend=simulated_keyboard(clock, strict=True))
+    packet = make_key_colors_packet("alphanum", {4: [255, 0, 0]})
+
+    hid.send_feature_report(packet)
+    with pytest.raises(HIDSendError):
+        hid.send_feature_report(packet)
+    assert hid.dropped_reports == 1
@@ -0,0 +1,57 @@
+"""The headless command line path stays cheap to import.
+
+msi_perkeyrgb_gui.main is imported under "python -X importtime" in a fresh
+interpreter. It must not pull in a GUI or validation library, and its
+cumulative import time, best of several runs, must stay within the budget.
+The budget can be raised on slow machines with $MSI_PERKEYRGB_IMPORT_BUDGET_MS.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MODULE = "msi_perkeyrgb_gui.main"
+FORBIDDEN_MODULES = ["gi", "pydantic", "webcolors", "numpy", "socketserver"]
+BUDGET_ENV = "MSI_PERKEYRGB_IMPORT_BUDGET_MS"
+DEFAULT_BUDGET_MS = 120
+RUNS = 5
+
+
+def import_times(module):
+    """{module name: cumulative import time in microseconds} for one fresh import"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue  # Header line
+    return times
+
+
+def test_main_does_not_import_heavy_modules():
+    forbidden = sorted(
+        name for name in import_times(MODULE) if name.split(".")[0] in FORBIDDEN_MODULES
+    )
+    assert not forbidden, "%s imports %s" % (MODULE, ", ".join(forbidden))
+
+
+def test_main_import_time_is_within_budget():
+    budget_ms = float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MS))
+    best_ms = min(import_times(MODULE)[MODULE] for _ in range(RUNS)) / 1000
+    assert best_ms <= budget_ms, "%s takes %.1f ms, budget is %.1f ms" % (
+        MODULE,
+        best_ms,
+        budget_ms,
+    )
@@ -0,0 +1,43 @@
+import threading
+
+from msi_perkeyrgb_gui.animation import AnimationStats, FrameClock
+from msi_perkeyrgb_gui.metrics import Metrics
+from msi_perkeyrgb_gui.writer import WriterStats, merge_frame
+
+
+def test_counters_add_up_across_threads():
+    metrics = Metrics()
+
+    def count():
+        for _ in range(10000):
+            metrics.add("frames_applied")
+            metrics.observe_report("colors", 524, 0.001, 0.0, True)
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.frames_applied == 80000
+    assert metrics.reports == {"colors": 80000}
+    assert metrics.report_bytes == 80000 * 524
+
+
+def test_writer_drops_and_animation_skips_are_counted_apart(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr("msi_perkeyrgb_gui.writer.get_metrics", lambda: metrics)
+    monkeypatch.setattr("msi_perkeyrgb_gui.animation.get_metrics", lambda: metrics)
+
+    merge_frame(WriterStats(), {1: [0, 0, 0]}, {1: [255, 255, 255]})
+
+    now = [0.0]
+    frame_clock = FrameClock(10, lambda: now[0], lambda seconds: None)
+    frame_clock.start()
+    now[0] = 0.35
+    frame_clock.advance(AnimationStats())
+
+    snapshot = metrics.snapshot()
+    assert snapshot["frames_dropped"] == 1
+    assert snapshot["frames_skipped"] == 2
+    assert "msi_perkeyrgb_frames_skipped_total 2" in metrics.prometheus()
@@ -0,0 +1,90 @@
+import pytest
+
+from msi_perkeyrgb_gui.hid_sim import SimulatedKeyboard
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard
+from msi_perkeyrgb_gui.protocol_data.keycodes import REGION_KEYCODES
+
+MODEL = "GP75"
+RED = [255, 0, 0]
+GREEN = [0, 255, 0]
+
+
+@pytest.fixture
+def sim():
+    return SimulatedKeyboard(latency=0, min_gap=0)
+
+
+@pytest.fixture
+def kb(sim, make_keyboard):
+    kb = make_keyboard(sim)
+    kb.set_color_all(RED)
+    kb.refresh()
+    return kb
+
+
+def sent_since(sim, start):
+    """Kinds of the reports sent after the first start ones"""
+    return [report.kind for report in list(sim.log)[start:]]
+
+
+def keys_by_region(kb):
+    regions = {}
+    for linux_keycode in MSIKeyboard.get_model_keymap(MODEL):
+        regions.setdefault(kb._layout.get_slot(linux_keycode).region, []).append(
+            linux_keycode
+        )
+    return regions
+
+
+def test_first_update_sends_every_region(sim, kb):
+    assert sent_since(sim, 0) == ["colors"] * len(REGION_KEYCODES) + ["refresh"]
+    assert set(sim.colors().values()) == {tuple(RED)}
+
+
+def test_unchanged_update_sends_nothing(sim, kb):
+    start = len(sim.log)
+    kb.set_color_all(RED)
+    kb.refresh()
+    assert sent_since(sim, start) == []
+
+
+def test_only_regions_with_changed_keys_are_sent(sim, kb):
+    regions = keys_by_region(kb)
+    changed = sorted(regions)[:2]
+    start = len(sim.log)
+
+    kb.set_colors({regions[region][0]: GREEN for region in changed})
+    kb.refresh()
+
+    assert sent_since(sim, start) == ["colors"] * len(changed) + ["refresh"]
+    assert list(sim.colors().values()).count(tuple(GREEN)) == len(changed)
+
+
+def test_refresh_is_skipped_when_nothing_was_sent(sim, kb):
+    start = len(sim.log)
+    kb.refresh()
+    kb.refresh()
+    assert sent_since(sim, start) == []
+
+
+def test_invalidate_forces_a_full_resend(sim, kb):
+    start = len(sim.log)
+    kb.invalidate()
+    kb.set_color_all(RED)
+    kb.refresh()
+    assert sent_since(sim, start) == ["colors"] * len(REGION_KEYCODES) + ["refresh"]
+
+
+def test_preset_is_always_sent_and_forces_a_full_resend(sim, kb):
+    preset = sorted(MSIKeyboard.get_model_presets(MODEL))[0]
+    for _ in range(2):
+        start = len(sim.log)
+        kb.set_preset(preset)
+        kb.refresh()
+        sent = sent_since(sim, start)
+        assert sent and sent[-1] == "refresh"
+
+    start = len(sim.log)
+    kb.set_color_all(RED)
+    kb.refresh()
+    assert sent_since(sim, start) == ["colors"] * len(REGION_KEYCODES) + ["refresh"]
@@ -0,0 +1,53 @@
+import pytest
+
+from msi_perkeyrgb_gui.hid_sim import decode_effect
+from msi_perkeyrgb_gui.msiprotocol import (
+    COLOR_SHIFT,
+    MAX_TRANSITIONS,
+    breathing_effect,
+    color_cycle_effect,
+    make_effect_packet,
+)
+
+
+def colors_reached(effect):
+    """Colors at the end of each step of the encoded effect, and its duration"""
+    _, decoded = decode_effect(make_effect_packet(1, effect))
+    color = [c << COLOR_SHIFT for c in decoded.start_color]
+    reached = []
+    for deltas, duration in decoded.transitions:
+        color = [c + delta * duration for c, delta in zip(color, deltas)]
+        reached.append(tuple(c >> COLOR_SHIFT for c in color))
+    return reached, decoded.total_duration
+
+
+@pytest.mark.parametrize(
+    "color, period",
+    [
+        ([32, 32, 32], 3000),
+        ([255, 0, 0], 10000),
+        ([255, 0, 0], 3000),
+        ([1, 2, 3], 60000),
+    ],
+)
+def test_slow_breathing_reaches_its_color(color, period):
+    reached, duration = colors_reached(breathing_effect(color, period))
+    assert tuple(color) in reached
+    assert max(reached) == tuple(color)
+    assert reached[-1] == (0, 0, 0)
+    assert duration == period
+
+
+def test_color_cycle_reaches_every_color():
+    colors = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [10, 20, 30], [200, 100, 50]]
+    reached, duration = colors_reached(color_cycle_effect(colors, 3000))
+    assert len(reached) <= MAX_TRANSITIONS
+    for color in colors:
+        assert tuple(color) in reached
+    assert all(0 <= c <= 255 for color in reached for c in color)
+    assert duration == 3000
+
+
+def test_effects_longer_than_16_bits_are_rejected():
+    with pytest.raises(ValueError):
+        make_effect_packet(1, breathing_effect([255, 0, 0], 0x10000))
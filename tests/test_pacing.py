@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from msi_perkeyrgb_gui.hid_sim import SimulatedKeyboard
+from msi_perkeyrgb_gui.pacing import (
+    CALIBRATION_MARGIN,
+    MIN_CALIBRATED_GAP,
+    CalibrationError,
+    calibrate_pacing,
+    load_cached_gap,
+)
+
+MODEL = "GP75"
+GAPS = [0.008, 0.006, 0.004, 0.002]
+
+
+@pytest.fixture
+def simulated_kb(make_keyboard):
+    def make(min_gap, dropped_count=True):
+        sim = SimulatedKeyboard(latency=0, min_gap=min_gap)
+        if not dropped_count:
+            sim.dropped = None  # Like the real controller
+        return make_keyboard(sim, 0.01)
+
+    return make
+
+
+def test_calibration_stops_at_the_first_gap_with_dropped_reports(simulated_kb):
+    kb = simulated_kb(min_gap=0.005)
+    gap = calibrate_pacing(kb, GAPS, frames=2)
+    assert gap == pytest.approx(0.006 * CALIBRATION_MARGIN)
+    assert kb.pacer.min_gap == 0.01
+
+
+def test_calibration_never_goes_below_the_floor(simulated_kb):
+    kb = simulated_kb(min_gap=0)
+    assert calibrate_pacing(kb, GAPS, frames=2) == MIN_CALIBRATED_GAP
+
+
+def test_calibration_without_dropped_count_needs_confirmation(simulated_kb):
+    kb = simulated_kb(min_gap=0, dropped_count=False)
+    with pytest.raises(CalibrationError):
+        calibrate_pacing(kb, GAPS, frames=2)
+
+    asked = []
+
+    def confirm(name):
+        asked.append(name)
+        return len(asked) < 3
+
+    gap = calibrate_pacing(kb, GAPS, frames=2, confirm=confirm)
+    assert asked == ["red", "green", "blue"]
+    assert gap == pytest.approx(0.006 * CALIBRATION_MARGIN)
+
+
+def test_cached_gaps_below_the_floor_are_ignored(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache = tmp_path / "msi-perkeyrgb-gui" / "pacing.json"
+    cache.parent.mkdir()
+    cache.write_text(json.dumps({MODEL: 0, "GS65": 0.008}))
+
+    assert load_cached_gap(MODEL) is None
+    assert load_cached_gap("GS65") == 0.008
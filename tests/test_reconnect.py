@@ -0,0 +1,79 @@
+import pytest
+
+from msi_perkeyrgb_gui.hid_sim import SIM_MIN_GAP, SimulatedKeyboard
+from msi_perkeyrgb_gui.hidapi_wrapping import (
+    BACKEND_ENV,
+    HIDNotFoundError,
+    HIDSendError,
+)
+from msi_perkeyrgb_gui.msikeyboard import MSIKeyboard
+from msi_perkeyrgb_gui.writer import RETRY_INTERVAL, KeyboardWriter
+
+MODEL = "GP75"
+
+
+class TrackedKeyboard(SimulatedKeyboard):
+    """Simulated keyboard remembering whether it was closed"""
+
+    def __init__(self, **kwargs):
+        super().__init__(latency=0, **kwargs)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+# Pacing for the keyboards reopened with the default simulator settings
+MIN_GAP = SIM_MIN_GAP * 1.2
+
+
+def test_failed_send_closes_the_handle(monkeypatch, make_keyboard):
+    monkeypatch.setenv(BACKEND_ENV, "sim")
+    # Every report after the first one comes too fast, and fails
+    backend = TrackedKeyboard(min_gap=60, strict=True)
+    kb = make_keyboard(backend, MIN_GAP)
+
+    with pytest.raises(HIDSendError):
+        kb.set_color_all([255, 0, 0])
+    assert not kb.connected
+    assert backend.closed
+
+    kb.reopen()
+    assert kb.connected
+    assert kb._hid_keyboard.backend is not backend
+    assert set(kb._hid_keyboard.backend.colors().values()) == {(255, 0, 0)}
+
+
+def test_frames_for_a_missing_keyboard_are_kept_but_not_sent(
+    monkeypatch, make_keyboard
+):
+    monkeypatch.setenv(BACKEND_ENV, "sim")
+    kb = make_keyboard(TrackedKeyboard(), MIN_GAP)
+    kb.disconnect()
+    attempts = []
+
+    def reopen(timeout=0):
+        attempts.append(timeout)
+        raise HIDNotFoundError
+
+    monkeypatch.setattr(kb, "reopen", reopen)
+    now = [0.0]
+    keycodes = list(MSIKeyboard.get_model_keymap(MODEL))
+
+    with KeyboardWriter(kb, clock=lambda: now[0]) as writer:
+        for k in keycodes[:2]:
+            writer.submit({k: [255, 0, 0]})
+            writer.flush()
+            now[0] += RETRY_INTERVAL / 2
+        assert writer.stats.sent == 0
+        assert attempts == [0]  # Not retried before RETRY_INTERVAL
+
+        # Back without a hotplug event, the next frame reopens it
+        monkeypatch.delattr(kb, "reopen")
+        writer.submit({keycodes[2]: [255, 0, 0]})
+        writer.flush()
+        assert writer.stats.sent == 1
+
+    assert kb.connected
+    colors = kb._hid_keyboard.backend.colors()
+    assert list(colors.values()) == [(255, 0, 0)] * 3
@@ -0,0 +1,39 @@
+import pytest
+
+from msi_perkeyrgb_gui.hid_sim import SimulatedKeyboard
+from msi_perkeyrgb_gui.hidapi_wrapping import BACKEND_ENV
+from msi_perkeyrgb_gui.main import apply_to_keyboards
+from msi_perkeyrgb_gui.writer import KeyboardGroup
+
+
+def red(kb):
+    kb.set_color_all([255, 0, 0])
+
+
+@pytest.mark.parametrize("synchronized", [False, True])
+def test_keyboards_applying_a_command_are_counted(synchronized, make_keyboard):
+    sims = [SimulatedKeyboard(latency=0, min_gap=0) for _ in range(2)]
+    keyboards = [make_keyboard(sim) for sim in sims]
+
+    with KeyboardGroup(keyboards, synchronized) as group:
+        assert group.call(red)
+
+    assert group.unapplied == 0
+    for sim in sims:
+        assert set(sim.colors().values()) == {(255, 0, 0)}
+
+
+@pytest.mark.parametrize("synchronized", [False, True])
+def test_failing_keyboards_make_the_command_fail(
+    synchronized, monkeypatch, make_keyboard
+):
+    monkeypatch.setenv(BACKEND_ENV, "sim")
+    # Every report after the first one comes too fast, and fails
+    failing = SimulatedKeyboard(latency=0, min_gap=60, strict=True)
+    keyboards = [
+        make_keyboard(SimulatedKeyboard(latency=0, min_gap=0)),
+        make_keyboard(failing),
+    ]
+
+    assert not apply_to_keyboards(keyboards, red, synchronized)
+    assert failing.dropped > 0